@@ -1,9 +1,10 @@
 cd $WS_PATH/rvv_testing/testing
 
+# All other arguments (e.g. --target, --no_build_cache) are forwarded, models
+# whose inputs did not change are restored from the build cache
 if [[ "$1" = "--trace" ]]; then
     echo "Build with trace"
-    ./run-test-matrix.py -r --trace
 else
     echo "Build without trace"
-    ./run-test-matrix.py -r
-fi
\ No newline at end of file
+fi
+./run-test-matrix.py -r "$@"
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import pathlib
+import shutil
+import subprocess
+from functools import cache
+
+import config
+from util import warn
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+PROJECT_ROOT_DIR = COMPARISON_PRJ_DIR.parent
+
+CACHE_DIR = (
+    pathlib.Path(config.BUILD_CACHE_DIR)
+    if config.BUILD_CACHE_DIR
+    else COMPARISON_PRJ_DIR / "comparison" / "cache" / "build"
+)
+KEY_FILE = "key.json"
+ARTIFACTS_DIR = "artifacts"
+FILES_DIR = "files"
+
+
+def _git(src_dir: pathlib.Path, *args: str) -> bytes | None:
+    try:
+        proc = subprocess.run(["git", "-C", src_dir, *args], capture_output=True)
+    except OSError:
+        return None
+    return proc.stdout if proc.returncode == 0 else None
+
+
+@cache
+def git_revision(src_dir: pathlib.Path) -> str | None:
+    """Checked out revision of a git tree, with "-dirty" for uncommitted changes."""
+    revision = _git(src_dir, "describe", "--always", "--dirty", "--abbrev=12")
+    return revision.decode("utf-8").strip() if revision else None
+
+
+@cache
+def source_tree_hash(src_dir: pathlib.Path) -> str | None:
+    """Hash of the checked out revision, submodule revisions, uncommitted and
+    untracked changes of a git tree. None if `src_dir` is not a git tree.
+    """
+    revision = _git(src_dir, "rev-parse", "HEAD")
+    if revision is None:
+        return None
+    tree_hash = hashlib.sha256(revision)
+    tree_hash.update(_git(src_dir, "submodule", "status", "--recursive") or b"")
+    tree_hash.update(_git(src_dir, "diff", "HEAD", "--binary") or b"")
+    untracked = _git(src_dir, "ls-files", "--others", "--exclude-standard", "-z")
+    for name in sorted((untracked or b"").split(b"\0")):
+        rel_path = name.decode("utf-8", errors="replace")
+        path = src_dir / rel_path
+        if rel_path.startswith(tuple(config.BUILD_CACHE_IGNORE_UNTRACKED)):
+            continue
+        if name and path.is_file():
+            tree_hash.update(name)
+            tree_hash.update(path.read_bytes())
+    return tree_hash.hexdigest()
+
+
+@cache
+def tool_version(args: tuple[str, ...]) -> str:
+    """First line of `<tool> --version`, empty if the tool can not be run."""
+    try:
+        proc = subprocess.run(args, capture_output=True, text=True)
+    except OSError:
+        return ""
+    return proc.stdout.partition("\n")[0]
+
+
+def artifact_dirs(templates: list[str], **params) -> list[pathlib.Path]:
+    """Resolves config artifact dir templates relative to the project root."""
+    return [PROJECT_ROOT_DIR / template.format(**params) for template in templates]
+
+
+def artifact_files(patterns: list[str], **params) -> list[pathlib.Path]:
+    """Files matching config artifact file patterns, relative to the project root."""
+    return sorted(
+        path
+        for pattern in patterns
+        for path in PROJECT_ROOT_DIR.glob(pattern.format(**params))
+        if path.is_file()
+    )
+
+
+def build_key(
+    kind: str, inputs: dict, src_dirs: list[pathlib.Path]
+) -> tuple[str, dict] | None:
+    """Returns the cache key of a build and all inputs it was derived from.
+
+    None if a source tree can not be hashed, such builds are not cached.
+    """
+    fname = "build_key"
+    inputs = dict(inputs, kind=kind)
+    for src_dir in src_dirs:
+        tree_hash = source_tree_hash(src_dir)
+        if tree_hash is None:
+            warn(fname, f"{src_dir} is not a git tree, not caching {kind} build")
+            return None
+        inputs[f"src:{src_dir.name}"] = tree_hash
+    key_string = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest(), inputs
+
+
+def contains(kind: str, key: str) -> bool:
+    # The key file is written last, entries without it are incomplete
+    return (CACHE_DIR / kind / key / KEY_FILE).is_file()
+
+
+def restore(kind: str, key: str, dirs: list[pathlib.Path]) -> bool:
+    """Replaces `dirs` with the cached artifacts of `key`, if there are any."""
+    entry_dir = CACHE_DIR / kind / key
+    if not contains(kind, key):
+        return False
+    for i, artifact_dir in enumerate(dirs):
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+        shutil.copytree(entry_dir / ARTIFACTS_DIR / str(i), artifact_dir, symlinks=True)
+    return True
+
+
+def store(kind: str, key: str, inputs: dict, dirs: list[pathlib.Path]) -> None:
+    """Copies the artifacts of a finished build into the cache."""
+    fname = "store"
+    entry_dir = CACHE_DIR / kind / key
+    tmp_dir = CACHE_DIR / kind / f".{key}.tmp"
+    missing = [artifact_dir for artifact_dir in dirs if not artifact_dir.is_dir()]
+    if missing:
+        warn(fname, f"Not caching {kind} build, missing artifacts: {missing}")
+        return
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for i, artifact_dir in enumerate(dirs):
+        shutil.copytree(artifact_dir, tmp_dir / ARTIFACTS_DIR / str(i), symlinks=True)
+    with open(tmp_dir / KEY_FILE, "w", encoding="utf-8") as key_file:
+        json.dump(inputs, key_file, indent=2, sort_keys=True, default=str)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp_dir.rename(entry_dir)
+
+
+def restore_files(kind: str, key: str) -> bool:
+    """Copies the cached files of `key` back to their paths below the project
+    root, if there are any. Other files next to them are left alone."""
+    entry_dir = CACHE_DIR / kind / key
+    if not contains(kind, key):
+        return False
+    files_dir = entry_dir / FILES_DIR
+    for cached_path in files_dir.rglob("*"):
+        if cached_path.is_file():
+            path = PROJECT_ROOT_DIR / cached_path.relative_to(files_dir)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(cached_path, path)
+    return True
+
+
+def store_files(kind: str, key: str, inputs: dict, files: list[pathlib.Path]) -> None:
+    """Copies the files of a finished build below the project root into the cache."""
+    fname = "store_files"
+    entry_dir = CACHE_DIR / kind / key
+    tmp_dir = CACHE_DIR / kind / f".{key}.tmp"
+    if not files:
+        warn(fname, f"Not caching {kind} build, no artifacts of {inputs}")
+        return
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for path in files:
+        cached_path = tmp_dir / FILES_DIR / path.relative_to(PROJECT_ROOT_DIR)
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, cached_path)
+    with open(tmp_dir / KEY_FILE, "w", encoding="utf-8") as key_file:
+        json.dump(inputs, key_file, indent=2, sort_keys=True, default=str)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp_dir.rename(entry_dir)
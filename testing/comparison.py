@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
 import csv
 import os
 import pathlib
-import re
-import sys
+from collections import deque
 from difflib import SequenceMatcher
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator
 
 import decoder
 import numpy as np
-from timingconfig import V_SHORT_SIGNAL, V_LONG_SIGNAL
+from profiler import profile_call
+from timingconfig import V_SHORT_SIGNAL, V_LONG_SIGNAL, VSET
 from util import blue, bold, check_path
 
 ARCH: str
@@ -24,9 +28,11 @@ COMPARISON_DIR = pathlib.Path(__file__).parent.parent / "comparison"
 check_path(COMPARISON_DIR)
 
 # vset(i)vl(i) retires after ID
-VSET_INSTRS = ["vsetvl", "vsetvli", "vsetivli"]
+VSET_INSTRS = VSET
 
 DELTA_TRESHOLD = 10
+# Rows rendered before and after each mismatch in the "mismatch" report mode
+REPORT_CONTEXT = 3
 VSET_TIMING_STAGE = "EX_stage"
 FAST_TIMING_STAGE = "EX_stage"
 # SLOW_TIMING_STAGE = "V_EX_LSU_ELM_Pack_substage"
@@ -125,7 +131,7 @@ def match_length(a: list, b: list, value) -> None:
 
 def write_out(
     outfile_path: pathlib.Path,
-    matching: list[str],
+    matching: Iterable[str],
     initial: list[str] | None = None,
     trailing: list[str] | None = None,
     etiss_cycles: tuple[int, int] = (0, 0),
@@ -175,6 +181,68 @@ def write_out(
             outfile.writelines(trailing)
 
 
+def render_match_row(
+    pc_e: str,
+    asm_e: int,
+    ins_e: str,
+    asm_v: int,
+    ins_v: str,
+    d_e: int,
+    d_v: int,
+    s_cycles: tuple[int, ...],
+    rtl_wb_cycles: int,
+) -> str:
+    stage_str = " ".join(
+        (name + ": " if STAGE_IN_COL else "") + f"{(s_cycles[i]):13} |"
+        for i, name in enumerate(PRINT_STAGES)
+    )
+    return (
+        f"{pc_e:8} |"
+        f"{ins_e:8} |"
+        f" {asm_e:08x} |"
+        f" {ins_v:8}   |"
+        f" {asm_v:08x} |"
+        f" dE: {d_e:7} |"
+        f" dV: {d_v:7} |"
+        f" Diff: {d_e - d_v:5} |"
+        f" {stage_str}"
+        f" WB V: {rtl_wb_cycles:10} |"
+        f"{" (A!)" if asm_e != asm_v else ""}"
+        f"{" (I!)" if ins_e != ins_v else ""}"
+        f"{"\n(D+!)" if d_e > d_v else "\n(D-!)" if d_e < d_v else ""}"
+        f"{"\n(DT!)" if abs(d_e - d_v) > DELTA_TRESHOLD else ""}"
+        f"\n"
+    )
+
+
+def render_mismatches(rows: Iterable[tuple], context: int) -> Iterator[str]:
+    """Renders only rows whose delta difference exceeds DELTA_TRESHOLD or whose
+    asm/instruction differ, plus `context` rows before and after each of them."""
+    previous: deque[tuple] = deque(maxlen=context)
+    trailing = 0
+    skipped = 0
+    for row in rows:
+        _, asm_e, ins_e, asm_v, ins_v, d_e, d_v, _, _ = row
+        if abs(d_e - d_v) > DELTA_TRESHOLD or asm_e != asm_v or ins_e != ins_v:
+            skipped -= len(previous)
+            if skipped > 0:
+                yield f"... ({skipped} rows)\n"
+            skipped = 0
+            while previous:
+                yield render_match_row(*previous.popleft())
+            yield render_match_row(*row)
+            trailing = context
+        elif trailing > 0:
+            yield render_match_row(*row)
+            trailing -= 1
+        else:
+            if context > 0:
+                previous.append(row)
+            skipped += 1
+    if skipped > 0:
+        yield f"... ({skipped} rows)\n"
+
+
 def read_verilator_trace(
     verilator_base_path: pathlib.Path, v_start: int, v_end: int
 ) -> dict:
@@ -342,7 +410,15 @@ def compare(
     target_sw,
     write_trailing: bool = False,
     write_initial: bool = False,
+    report_mode: str = "full",
+    context: int = REPORT_CONTEXT,
 ) -> tuple[float, float, float, int, int, bool]:
+    """Compares the traces and writes the match report.
+
+    `report_mode` "full" renders every matched instruction, "mismatch" only the
+    rows flagged by DELTA_TRESHOLD or asm/instruction differences plus `context`
+    rows around them.
+    """
 
     global ARCH, VLEN, VLANE_WIDTH, TARGET_SW
 
@@ -461,55 +537,30 @@ def compare(
     print_info(f"(Cycles) ETISS CPI is {cpi_factor * 100:.4f}% of RTL CPI")
     print_info(f"(Cycles) Error: {error :.4f}%")
 
-    stage_cycles = list(
-        zip(
-            *[
-                etiss["stage_cycles"][name][match_start_etiss:match_end_etiss]
-                for name in PRINT_STAGES
-            ]
-        )
+    stage_cycles = zip(
+        *[
+            islice(etiss["stage_cycles"][name], match_start_etiss, match_end_etiss)
+            for name in PRINT_STAGES
+        ]
     )
 
-    matching = [
-        (
-            f"{pc_e:8} |"
-            f"{ins_e:8} |"
-            f" {asm_e:08x} |"
-            f" {ins_v:8}   |"
-            f" {asm_v:08x} |"
-            f" dE: {d_e:7} |"
-            f" dV: {d_v:7} |"
-            f" Diff: {d_e - d_v:5} |"
-            f" {re.sub(r"[\[\],\']", "", str([(name + ": " if STAGE_IN_COL else "") + f"{(s_cycles[i]):13} |" for i, name in enumerate(PRINT_STAGES)]))}"
-            f" WB V: {rtl_wb_cycles:10} |"
-            f"{" (A!)" if asm_e != asm_v else ""}"
-            f"{" (I!)" if ins_e != ins_v else ""}"
-            f"{"\n(D+!)" if d_e > d_v else "\n(D-!)" if d_e < d_v else ""}"
-            f"{"\n(DT!)" if abs(d_e - d_v) > DELTA_TRESHOLD else ""}"
-            f"\n"
-        )
-        for (
-            pc_e,
-            asm_e,
-            ins_e,
-            asm_v,
-            ins_v,
-            d_e,
-            d_v,
-            s_cycles,
-            rtl_wb_cycles,
-        ) in zip(
-            etiss["pc"][match_start_etiss:match_end_etiss],
-            etiss["asm"][match_start_etiss:match_end_etiss],
-            etiss["instrs"][match_start_etiss:match_end_etiss],
-            verilator["asm"][match_start_verilator:match_end_verilator],
-            verilator["instrs"][match_start_verilator:match_end_verilator],
-            etiss["delta"][match_start_etiss:match_end_etiss],
-            verilator["delta"][match_start_verilator:match_end_verilator],
-            stage_cycles,
-            verilator["cycles"][match_start_verilator:match_end_verilator],
-        )
-    ]
+    rows = zip(
+        islice(etiss["pc"], match_start_etiss, match_end_etiss),
+        islice(etiss["asm"], match_start_etiss, match_end_etiss),
+        islice(etiss["instrs"], match_start_etiss, match_end_etiss),
+        islice(verilator["asm"], match_start_verilator, match_end_verilator),
+        islice(verilator["instrs"], match_start_verilator, match_end_verilator),
+        islice(etiss["delta"], match_start_etiss, match_end_etiss),
+        islice(verilator["delta"], match_start_verilator, match_end_verilator),
+        stage_cycles,
+        islice(verilator["cycles"], match_start_verilator, match_end_verilator),
+    )
+
+    # Rows are rendered while write_out writes them
+    if report_mode == "mismatch":
+        matching = render_mismatches(rows, context)
+    else:
+        matching = (render_match_row(*row) for row in rows)
 
     initial = None
     trailing = None
@@ -581,19 +632,42 @@ def compare(
 
 
 if __name__ == "__main__":
-
-    # TODO: argparse
-    arch = sys.argv[1]
-    vlen = int(sys.argv[2])
-    vlane_width = int(sys.argv[3])
-    target_sw = sys.argv[4]
-
-    write_trailing = False
-    write_initial = False
-
-    if "-t" in sys.argv:
-        write_trailing = True
-    if "-i" in sys.argv:
-        write_initial = True
-
-    compare(arch, vlen, vlane_width, target_sw, write_trailing, write_initial)
+    parser = argparse.ArgumentParser(
+        prog="Comparison",
+        description="Compares ETISS and Verilator traces and writes a match report",
+    )
+    parser.add_argument("arch", type=str)
+    parser.add_argument("vlen", type=int)
+    parser.add_argument("vlane_width", type=int)
+    parser.add_argument("target_sw", type=str)
+    parser.add_argument("-t", "--trailing", action="store_true")
+    parser.add_argument("-i", "--initial", action="store_true")
+    parser.add_argument(
+        "--report", type=str, choices=["full", "mismatch"], default="full"
+    )
+    parser.add_argument("--context", type=int, default=REPORT_CONTEXT)
+    # Run the comparison under cProfile / tracemalloc, see profiler.py
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile_mem", "--profile-mem", action="store_true")
+    args = parser.parse_args()
+
+    compare_call = partial(
+        compare,
+        args.arch,
+        args.vlen,
+        args.vlane_width,
+        args.target_sw,
+        args.trailing,
+        args.initial,
+        args.report,
+        args.context,
+    )
+    if args.profile or args.profile_mem:
+        profile_call(
+            compare_call,
+            f"comparison_{args.target_sw}_{args.arch}_zvl{args.vlen}b_vlane{args.vlane_width}",
+            args.profile,
+            args.profile_mem,
+        )
+    else:
+        compare_call()
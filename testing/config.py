@@ -54,7 +54,176 @@ TEST_CONFIG = {
     },
 }
 
+# Dynamic instruction count of a target : {VLEN : count}
+INSTR_COUNT = {
+    "tflm_vww": {
+        128: 71298379,
+        256: 68974858,
+        512: 69103622,
+        1024: 74900400,
+    },
+    "tflm_toy": {
+        128: 587766,
+        256: 414096,
+        512: 325618,
+        1024: 282058,
+    },
+    "tflm_aww": {
+        128: 29016385,
+        256: 27607588,
+        512: 26906876,
+        1024: 26554756,
+    },
+}
+
+# Upper bound of every simulation timeout in seconds. The timeout of a job is
+# TIMEOUT_FACTOR x the p95 of its recorded wall times, at least TIMEOUT_MIN_S.
+# Jobs that never ran get TIMEOUT_FALLBACK_S, or TIMEOUT_FACTOR x their
+# INSTR_COUNT estimate if that is longer. A job that timed out gets at least
+# TIMEOUT_RETRY_FACTOR x that timeout until it finishes once.
 TIMEOUT = 200000
+TIMEOUT_FACTOR = 3
+TIMEOUT_MIN_S = 300
+TIMEOUT_FALLBACK_S = 7200
+TIMEOUT_RETRY_FACTOR = 2
+
+# Resource budget of parallel builds and runs, None uses all cores / available memory
+MAX_CORES = None
+MAX_MEM_MB = None
+
+# Threads and peak memory of a single Verilator model build
+RTL_BUILD_THREADS = 4
+RTL_BUILD_MEM_MB = {
+    # VLEN : MB
+    64: 3000,
+    128: 3000,
+    256: 4000,
+    512: 6000,
+    1024: 8000,
+}
+
+# Threads and peak memory of a single test program build (all targets of one
+# arch / VLEN)
+TEST_BUILD_THREADS = 2
+TEST_BUILD_MEM_MB = 1000
+
+# Threads and peak memory of a single simulation
+SIM_THREADS = {"etiss": 1, "verilator": 1}
+SIM_MEM_MB = {"etiss": 500, "verilator": 1000}
+
+# Build cache for RTL models and test programs, None uses comparison/cache/build
+BUILD_CACHE_DIR = None
+# Directories an RTL build writes its model to, relative to the project root.
+# Every directory is stored as a whole on a cache miss and replaced on a hit.
+# The simulation cache and golden archive also hash the RTL model directories.
+# The output directory of build-rtl.sh is not confirmed yet, run-test-matrix.py
+# warns and does not cache the builds and simulations of a missing model.
+RTL_ARTIFACT_DIRS = [
+    "Vicuna2/build/{arch}/zvl{vlen}b/vlane{vlane_width}",
+]
+# Glob patterns of the files a test build writes for one program, relative to
+# the project root. Programs are cached one by one, all programs of an arch and
+# VLEN share their build directories.
+TEST_ARTIFACT_FILES = [
+    "Vicuna2/build_from_other/{arch}/zvl{vlen}b/{target}.*",
+    "Vicuna2/build_from_other/{arch}/zvl{vlen}b/dump/{target}_dump.txt",
+    "Perfsim/target_sw/examples/Vicuna/custom/{arch}/zvl{vlen}b/{target}.*",
+    "Perfsim/target_sw/examples/Vicuna/custom/{arch}/zvl{vlen}b/dump/{target}.dump",
+]
+# Untracked files below these paths of a source tree (build outputs) are not
+# part of the cache key
+BUILD_CACHE_IGNORE_UNTRACKED = ["build/", "build_from_other/"]
+# Version commands of the tools whose output is part of the cache key
+RTL_TOOL_VERSION_ARGS = ("verilator", "--version")
+COMPILER_VERSION_ARGS = {
+    "gcc": ("riscv32-unknown-elf-gcc", "--version"),
+    "llvm": ("clang", "--version"),
+}
+
+# Simulation cache, None uses comparison/cache/sim. Least recently used
+# simulations are evicted once the cache exceeds SIM_CACHE_MAX_MB.
+SIM_CACHE_DIR = None
+SIM_CACHE_MAX_MB = 100000
+# Glob patterns of the program files a simulator loads, relative to the
+# project root
+SIM_PROGRAM_FILES = {
+    "etiss": ["Perfsim/target_sw/examples/Vicuna/custom/{arch}/zvl{vlen}b/{target}.*"],
+    "verilator": ["Vicuna2/build_from_other/{arch}/zvl{vlen}b/{target}.*"],
+}
+# Built simulation models, all of their files are part of the cache key. A
+# simulator without model directories is not cached, list the ETISS install
+# directory with its plugins to cache ETISS runs.
+SIM_MODEL_DIRS = {
+    "etiss": [],
+    "verilator": RTL_ARTIFACT_DIRS,
+}
+# Traces written by a simulation to comparison/<simulator>/<arch>/zvl<vlen>b/vlane<w>
+SIM_TRACE_FILES = {
+    "etiss": ["{target}_trace.txt", "{target}_timing.csv"],
+    "verilator": ["{target}_trace.txt"],
+}
+
+# Compressed Verilator traces keyed on (RTL model, program, VLEN, VLANE_WIDTH),
+# None uses comparison/cache/golden. Least recently used traces are evicted
+# once the archive exceeds GOLDEN_ARCHIVE_MAX_MB.
+GOLDEN_ARCHIVE_DIR = None
+GOLDEN_ARCHIVE_MAX_MB = 100000
+GOLDEN_ARCHIVE_COMPRESSLEVEL = 6
+
+# Lines of simulator stdout / stderr kept in memory for reporting, the whole
+# output is written to comparison/logs/run
+OUTPUT_TAIL_LINES = 50
+
+# Simulations start longest first. Their wall time is estimated from the
+# median of the last JOB_HISTORY_RUNS runs, without history from INSTR_COUNT
+# and the simulator speed, else DEFAULT_SIM_ESTIMATE_S.
+JOB_HISTORY_RUNS = 20
+SIM_INSTRS_PER_S = {"etiss": 2000000, "verilator": 20000}
+DEFAULT_SIM_ESTIMATE_S = 60
+
+# Seconds between samples of a simulation's process tree from /proc (peak RSS,
+# CPU time, I/O). With a recorded peak RSS, a simulation reserves that times
+# SIM_MEM_MARGIN instead of SIM_MEM_MB.
+MONITOR_INTERVAL_S = 1.0
+SIM_MEM_MARGIN = 1.2
+
+# SQLite database of all run and comparison results, None uses
+# comparison/results.db. resultsdb.py regressions reports configurations whose
+# absolute CPI error grew by more than REGRESSION_THRESHOLD_PCT.
+RESULTS_DB = None
+REGRESSION_THRESHOLD_PCT = 1.0
+
+# Host and port the coordinator of a distributed matrix serves tasks on
+# (run-test-matrix.py --coordinator, --bind). Workers on other hosts need the
+# coordinator bound to an interface they can reach, "" binds all interfaces.
+DISTRIBUTED_HOST = "localhost"
+DISTRIBUTED_PORT = 50000
+# Shared secret of the coordinator and its workers, read from the environment
+# variable or else the file (never from the repository). Anyone with the key can
+# run code on the coordinator and the workers.
+DISTRIBUTED_AUTHKEY_ENV = "RVV_TESTING_AUTHKEY"
+DISTRIBUTED_AUTHKEY_FILE = "~/.config/rvv_testing/authkey"
+# Workers send a heartbeat every DISTRIBUTED_HEARTBEAT_S, the jobs of a worker
+# without one for DISTRIBUTED_HEARTBEAT_TIMEOUT_S are queued again. A
+# simulation held by a worker for DISTRIBUTED_TIMEOUT_MARGIN_S longer than its
+# timeout fails, the margin covers waiting for the worker's cores.
+DISTRIBUTED_HEARTBEAT_S = 10
+DISTRIBUTED_HEARTBEAT_TIMEOUT_S = 60
+DISTRIBUTED_TIMEOUT_MARGIN_S = 600
+
+# --profile / --profile-mem: functions and allocations printed per profiled
+# comparison, allocations written to its _alloc.txt, traceback frames
+# tracemalloc keeps per allocation and seconds between memory snapshots
+PROFILE_TOP_FUNCTIONS = 20
+PROFILE_TOP_ALLOCATIONS = 100
+PROFILE_MEM_FRAMES = 1
+PROFILE_MEM_INTERVAL_S = 1.0
+
+# Progress of compare_fast is checked every COMPARE_PROGRESS_INSTRS instructions
+# (0 disables it) and printed at most every COMPARE_PROGRESS_INTERVAL_S
+COMPARE_PROGRESS_INSTRS = 100000
+COMPARE_PROGRESS_INTERVAL_S = 30
+
 STOP_ON_ERROR = False
 PRINT_STDERR = True
 PRINT_BUILD_STDOUT = True
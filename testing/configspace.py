@@ -0,0 +1,93 @@
+import fnmatch
+
+VLANE_WIDTH_COMBINATIONS = {
+    # VLEN : [legal VLANE_Ws]
+    64: [32],
+    128: [32, 64],
+    256: [32, 64, 128],
+    512: [32, 64, 128, 256],
+    1024: [32, 64, 128, 256, 512],
+}
+
+# (arch, VLEN, VLANE_WIDTH, target)
+Config = tuple[str, int, int, str]
+
+
+def enumerate_configs(
+    test_config: dict,
+    archs: list[str] | None = None,
+    vlens: list[int] | None = None,
+    vlane_widths: list[int] | None = None,
+    target_glob: str | None = None,
+    only: set[tuple] | None = None,
+) -> list[Config]:
+    """All legal configurations of a test config that pass every given filter.
+
+    Architectures marked `skip` are only enumerated if they are selected with
+    `archs`. `only` holds (arch, VLEN, VLANE_WIDTH, target) tuples, a VLANE_WIDTH
+    of None matches every lane width.
+    """
+    configs = []
+    for arch, arch_config in test_config.items():
+        if archs is not None:
+            if arch not in archs:
+                continue
+        elif arch_config["skip"]:
+            continue
+        for vlen in arch_config["vlens"]:
+            if vlens is not None and vlen not in vlens:
+                continue
+            for vlane_width in arch_config["vlane_widths"]:
+                if vlane_width not in VLANE_WIDTH_COMBINATIONS[vlen]:
+                    # Skip illegal VLEN / VLANE_W combinations
+                    continue
+                if vlane_widths is not None and vlane_width not in vlane_widths:
+                    continue
+                for target in arch_config["targets"]:
+                    if target_glob and not fnmatch.fnmatchcase(target, target_glob):
+                        continue
+                    config = (arch, vlen, vlane_width, target)
+                    if only is not None and not (
+                        config in only or (arch, vlen, None, target) in only
+                    ):
+                        continue
+                    configs.append(config)
+    return configs
+
+
+def rtl_configs(configs: list[Config]) -> list[tuple[str, int, int]]:
+    """(arch, VLEN, VLANE_WIDTH) of every RTL model the configurations need."""
+    return list(dict.fromkeys(config[:3] for config in configs))
+
+
+def test_build_configs(configs: list[Config]) -> list[tuple[str, int]]:
+    """(arch, VLEN) of every test program build the configurations need."""
+    return list(dict.fromkeys(config[:2] for config in configs))
+
+
+def etiss_configs(configs: list[Config]) -> list[tuple[str, int, str]]:
+    """(arch, VLEN, target) of every ETISS run, ETISS does not depend on the
+    lane width."""
+    return list(
+        dict.fromkeys((arch, vlen, target) for arch, vlen, _, target in configs)
+    )
+
+
+def etiss_vlane_width(vlen: int, vlane_widths: list[int]) -> int | None:
+    """VLANE_WIDTH the shared ETISS run of a VLEN is started with.
+
+    ETISS does not model the lane width, so its trace only needs to exist once
+    per (arch, VLEN, target). Its output directory still contains the lane
+    width, the smallest legal one is used.
+    """
+    legal_widths = [w for w in vlane_widths if w in VLANE_WIDTH_COMBINATIONS[vlen]]
+    return min(legal_widths) if legal_widths else None
+
+
+def parse_list(list_str: str) -> list[str]:
+    """Parses a comma separated list."""
+    return [item for item in list_str.split(",") if item]
+
+
+def parse_int_list(list_str: str) -> list[int]:
+    return [int(item) for item in parse_list(list_str)]
@@ -0,0 +1,360 @@
+import asyncio
+import itertools
+import os
+import pathlib
+import queue
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import BaseManager
+
+import config
+import timeline
+from jobhistory import job_name
+from taskgraph import TaskGraph
+from util import error, info, success, warn
+
+# Seconds a worker waits for a job before it checks if the matrix is finished
+POLL_INTERVAL_S = 1.0
+
+# Timeline phase of the tasks of a graph phase, as recorded by a local run
+TIMELINE_PHASES = {
+    "build_rtl": "build_rtl",
+    "build_test": "build_test",
+    "run": "run_test",
+    "compare": "compare_fast",
+}
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+def authkey() -> bytes:
+    """Shared secret from config.DISTRIBUTED_AUTHKEY_ENV or else
+    config.DISTRIBUTED_AUTHKEY_FILE, exits without one."""
+    fname = "authkey"
+    key = os.environ.get(config.DISTRIBUTED_AUTHKEY_ENV, "").strip()
+    if key:
+        return key.encode("utf-8")
+    key_path = pathlib.Path(config.DISTRIBUTED_AUTHKEY_FILE).expanduser()
+    if key_path.is_file():
+        if key_path.stat().st_mode & 0o077:
+            warn(fname, f"{key_path} is readable by other users")
+        key = key_path.read_text(encoding="utf-8").strip()
+        if key:
+            return key.encode("utf-8")
+    error(
+        fname,
+        f"No key for the coordinator and its workers, set {config.DISTRIBUTED_AUTHKEY_ENV} "
+        f"or write one to {key_path} on all hosts, e.g. with "
+        "python3 -c 'import secrets; print(secrets.token_hex(32))'",
+    )
+    exit(1)
+
+
+class Session:
+    """State the coordinator shares with its workers, besides the results queue.
+
+    Workers take their jobs from the session, which keeps track of the worker
+    that holds each job and of the last heartbeat of every worker.
+    """
+
+    def __init__(
+        self, argv: list[str], configs: list[tuple], jobs: queue.PriorityQueue
+    ) -> None:
+        self._argv = argv
+        self._configs = configs
+        self._jobs = jobs
+        self._workers: list[str] = []
+        self._cancelled: set[tuple] = set()
+        self._finished = False
+        self._lock = threading.Lock()
+        # Task key: (worker, queue entry, time it was taken)
+        self._assigned: dict[tuple, tuple[str, tuple, float]] = {}
+        # Worker: time of its last heartbeat
+        self._heartbeats: dict[str, float] = {}
+
+    def argv(self) -> list[str]:
+        return self._argv
+
+    def configs(self) -> list[tuple]:
+        return self._configs
+
+    def register(self, worker: str) -> None:
+        self._workers.append(worker)
+        self.heartbeat(worker)
+        info("Coordinator", f"Worker {worker} connected")
+
+    def heartbeat(self, worker: str) -> None:
+        with self._lock:
+            self._heartbeats[worker] = time.monotonic()
+
+    def take(self, worker: str) -> tuple | None:
+        """Next job that was not cancelled, None if none is queued within
+        POLL_INTERVAL_S. The job is held by `worker` until it is released."""
+        while True:
+            try:
+                entry = self._jobs.get(timeout=POLL_INTERVAL_S)
+            except queue.Empty:
+                return None
+            key = entry[2]
+            if key in self._cancelled:
+                continue
+            with self._lock:
+                self._assigned[key] = (worker, entry, time.monotonic())
+            return key
+
+    def release(self, key: tuple, worker: str) -> None:
+        """Ends the assignment of a job to a worker, a job that was queued again
+        and taken by another worker in the meantime stays assigned."""
+        with self._lock:
+            if key in self._assigned and self._assigned[key][0] == worker:
+                del self._assigned[key]
+
+    def running(self) -> dict[tuple, tuple[str, float]]:
+        """Task key: (worker, seconds since it was taken) of all held jobs."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: (worker, now - taken)
+                for key, (worker, _, taken) in self._assigned.items()
+            }
+
+    def requeue_lost(self, timeout_s: float) -> list[tuple[tuple, str]]:
+        """Queues the jobs of workers without a heartbeat for `timeout_s` again,
+        returns (task key, worker) of every queued job."""
+        now = time.monotonic()
+        lost = []
+        with self._lock:
+            for key, (worker, entry, _) in list(self._assigned.items()):
+                if now - self._heartbeats.get(worker, 0.0) > timeout_s:
+                    del self._assigned[key]
+                    self._jobs.put(entry)
+                    lost.append((key, worker))
+        return lost
+
+    def cancel(self, key: tuple) -> None:
+        self._cancelled.add(key)
+
+    def is_cancelled(self, key: tuple) -> bool:
+        return key in self._cancelled
+
+    def finish(self) -> None:
+        self._finished = True
+
+    def is_finished(self) -> bool:
+        return self._finished
+
+
+def set_result(future: asyncio.Future, result) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+class Coordinator:
+    """Serves the tasks of a TaskGraph to workers on other hosts.
+
+    The coordinator keeps resolving dependencies, only tasks whose dependencies
+    are done are queued, longest expected task first. All hosts need the project
+    on shared storage under the same path.
+
+    Jobs of a worker whose heartbeat stops are queued again. A job with a
+    timeout fails once it is held DISTRIBUTED_TIMEOUT_MARGIN_S longer than that.
+
+    Workers run the coordinator's arguments and the coordinator unpickles their
+    requests, both sides authenticate each other with the shared authkey().
+    """
+
+    def __init__(
+        self, host: str, port: int, argv: list[str], configs: list[tuple]
+    ) -> None:
+        # (-estimate, sequence number, task key), ties are served in order
+        self.jobs: queue.PriorityQueue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.results: queue.Queue = queue.Queue()
+        self.session = Session(argv, configs, self.jobs)
+        # Task key: (event loop, future) of the waiting task
+        self.pending: dict[tuple, tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        # Task key: timeout in seconds, for tasks that have one
+        self.timeouts: dict[tuple, float] = {}
+
+        QueueManager.register("get_results", callable=lambda: self.results)
+        QueueManager.register("get_session", callable=lambda: self.session)
+        manager = QueueManager(address=(host, port), authkey=authkey())
+        server = manager.get_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.collect, daemon=True).start()
+        threading.Thread(target=self.watch, daemon=True).start()
+        info("Coordinator", f"Serving tasks on {host or '*'}:{port}")
+
+    def resolve(self, key: tuple, result: tuple) -> None:
+        entry = self.pending.get(key)
+        if entry is None:
+            # Cancelled or already resolved
+            return
+        loop, future = entry
+        loop.call_soon_threadsafe(set_result, future, result)
+
+    def collect(self) -> None:
+        while True:
+            key, ok, result, elapsed, worker = self.results.get()
+            self.session.release(key, worker)
+            if key in self.pending:
+                info("Coordinator", f"{job_name(key)} finished on {worker}")
+            self.resolve(key, (ok, result, elapsed))
+
+    def watch(self) -> None:
+        fname = "Coordinator"
+        while True:
+            time.sleep(config.DISTRIBUTED_HEARTBEAT_S)
+            for key, worker in self.session.requeue_lost(
+                config.DISTRIBUTED_HEARTBEAT_TIMEOUT_S
+            ):
+                warn(fname, f"Lost worker {worker}, queued {job_name(key)} again")
+            for key, (worker, held_s) in self.session.running().items():
+                timeout = self.timeouts.get(key)
+                if (
+                    timeout is not None
+                    and held_s > timeout + config.DISTRIBUTED_TIMEOUT_MARGIN_S
+                ):
+                    error(
+                        fname,
+                        f"{job_name(key)} on {worker} exceeded its timeout of {timeout:.0f}s, failing it",
+                    )
+                    self.session.release(key, worker)
+                    self.session.cancel(key)
+                    self.resolve(key, (False, None, None))
+
+    async def run(
+        self,
+        key: tuple,
+        results: dict,
+        estimate: float = 0.0,
+        timeout: float | None = None,
+    ) -> bool:
+        """Runs a task on the next free worker, results of comparisons are stored
+        in `results`.
+
+        The task's span on the timeline ends when its result arrives and lasts
+        as long as the worker ran it.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[key] = (loop, future)
+        if timeout is not None:
+            self.timeouts[key] = timeout
+        self.jobs.put((-estimate, next(self.sequence), key))
+        try:
+            ok, result, elapsed = await future
+        except asyncio.CancelledError:
+            self.session.cancel(key)
+            raise
+        finally:
+            del self.pending[key]
+        if elapsed is not None:
+            end = time.monotonic()
+            timeline.add(
+                job_name(key), TIMELINE_PHASES[key[0]], end - elapsed, end, key
+            )
+        if result is not None:
+            results[key[1:]] = result
+        return ok
+
+    def finish(self) -> None:
+        """Workers exit once they poll the queue next."""
+        self.session.finish()
+
+
+def connect(address: str) -> QueueManager:
+    host, _, port = address.rpartition(":")
+    QueueManager.register("get_results")
+    QueueManager.register("get_session")
+    manager = QueueManager(address=(host, int(port)), authkey=authkey())
+    try:
+        manager.connect()
+    except AuthenticationError:
+        error("connect", f"Coordinator {address} uses another key")
+        exit(1)
+    return manager
+
+
+def next_job(session, worker: str) -> tuple | None:
+    """Blocks until the next job that was not cancelled, None once the matrix is
+    finished or the coordinator is gone."""
+    while True:
+        try:
+            key = session.take(worker)
+            if key is not None:
+                return key
+            if session.is_finished():
+                return None
+        except (EOFError, OSError):
+            return None
+
+
+def send_heartbeats(session, worker: str, stop: threading.Event) -> None:
+    while not stop.wait(config.DISTRIBUTED_HEARTBEAT_S):
+        try:
+            session.heartbeat(worker)
+        except (EOFError, OSError):
+            return
+
+
+async def work(
+    manager: QueueManager, graph: TaskGraph, results: dict, slots: int
+) -> None:
+    """Runs tasks of `graph` pulled from the coordinator, at most `slots` at once.
+
+    The graph has to be built from the same arguments and configurations as the
+    coordinator's, dependencies are resolved by the coordinator.
+    """
+    fname = "Worker"
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    results_queue = manager.get_results()
+    session = manager.get_session()
+    session.register(name)
+    stop_heartbeats = threading.Event()
+    threading.Thread(
+        target=send_heartbeats, args=(session, name, stop_heartbeats), daemon=True
+    ).start()
+    free_slots = asyncio.Semaphore(slots)
+    running = set()
+
+    async def run(key: tuple) -> None:
+        task = graph.get(key)
+        start_time = time.monotonic()
+        try:
+            if task is None:
+                error(
+                    fname,
+                    f"Unknown task {key}, are the coordinator's sources the same?",
+                )
+                ok = False
+            else:
+                info(fname, f"Running {task.label}")
+                ok = await task.run()
+        except Exception as e:
+            error(fname, f"{task.label} raised {type(e).__name__}: {e}")
+            ok = False
+        finally:
+            free_slots.release()
+        elapsed = time.monotonic() - start_time
+        result = results.get(key[1:]) if key[0] == "compare" else None
+        try:
+            await asyncio.to_thread(results_queue.put, (key, ok, result, elapsed, name))
+        except (EOFError, OSError):
+            warn(fname, f"Coordinator gone, result of {key} is lost")
+
+    while True:
+        await free_slots.acquire()
+        key = await asyncio.to_thread(next_job, session, name)
+        if key is None:
+            break
+        job = asyncio.create_task(run(key))
+        running.add(job)
+        job.add_done_callback(running.discard)
+    await asyncio.gather(*running)
+    stop_heartbeats.set()
+    success(fname, "Matrix finished")
@@ -1,8 +1,30 @@
+import gzip
 import pathlib
 import os
+import time
+from contextlib import ExitStack
+from typing import TextIO
+
+import config
 
 from comp_util import print_info, match_length
-from util import check_path, error
+from hotspots import (
+    ABS_SUM_DIFF,
+    COUNT,
+    MAX_DIFF,
+    SUM_DIFF,
+    read_symbols,
+    write_hotspot_report,
+)
+from matchstore import MatchStoreWriter
+from timingconfig import (
+    INSTR_CLASS_IDS,
+    INSTR_CLASS_NAMES,
+    INSTR_CLASS_TIMING_STAGES,
+    OTHER_CLASS_ID,
+    SCALAR_TIMING_STAGE,
+)
+from util import error, info, warn
 
 START_LABEL = "address_match_start"
 END_LABEL = "address_match_end"
@@ -12,6 +34,7 @@ COMPARISON_PRJ_DIR = SRC_DIR.parent
 PROJECT_ROOT_DIR = COMPARISON_PRJ_DIR.parent
 VICUNA_DIR = PROJECT_ROOT_DIR / "Vicuna2"
 PERFSIM_DIR = PROJECT_ROOT_DIR / "Perfsim"
+COMPARISON_DIR = COMPARISON_PRJ_DIR / "comparison"
 
 
 def read_addresses(
@@ -102,6 +125,72 @@ def parse_stages(line: str) -> dict[str, int]:
     return stages
 
 
+def raw_offset(text_file: TextIO) -> int:
+    """Bytes read from the file below a text file so far, compressed bytes for
+    a gzip file. Includes read-ahead, but reads nothing itself."""
+    if isinstance(text_file.buffer, gzip.GzipFile):
+        return text_file.buffer.fileobj.tell()
+    return text_file.buffer.raw.tell()
+
+
+def file_size(text_file: TextIO) -> int:
+    if isinstance(text_file.buffer, gzip.GzipFile):
+        return os.fstat(text_file.buffer.fileobj.fileno()).st_size
+    return os.fstat(text_file.fileno()).st_size
+
+
+class CompareProgress:
+    """Progress of a comparison: instructions, throughput per input file, ETA
+    from the byte offsets in the input files and the running CPI error.
+
+    Progress is measured from the offsets at creation (the first compared
+    instruction), the bytes skipped before the start address do not count.
+
+    `report` is called every COMPARE_PROGRESS_INSTRS instructions and prints at
+    most every COMPARE_PROGRESS_INTERVAL_S.
+    """
+
+    def __init__(self, name: str, inputs: dict[str, TextIO]) -> None:
+        self.name = name
+        self.inputs = inputs
+        self.sizes = {label: file_size(file) for label, file in inputs.items()}
+        self.start_time = self.last_time = time.monotonic()
+        self.start_offsets = {label: raw_offset(file) for label, file in inputs.items()}
+        self.last_offsets = dict(self.start_offsets)
+        self.last_instrs = 0
+
+    def report(self, n_instrs: int, cycles_e: int, cycles_v: int) -> None:
+        now = time.monotonic()
+        interval = now - self.last_time
+        if interval < config.COMPARE_PROGRESS_INTERVAL_S:
+            return
+        offsets = {label: raw_offset(file) for label, file in self.inputs.items()}
+        throughput = ", ".join(
+            f"{label} {(offsets[label] - self.last_offsets[label]) / interval / (1 << 20):.1f} MB/s"
+            for label in self.inputs
+        )
+        # The input that is read slowest relative to its size
+        done = min(
+            (
+                (offsets[label] - self.start_offsets[label])
+                / (self.sizes[label] - self.start_offsets[label])
+                if self.sizes[label] > self.start_offsets[label]
+                else 1.0
+            )
+            for label in self.inputs
+        )
+        eta = (now - self.start_time) * (1 - done) / done if done else 0.0
+        cpi_error = (cycles_e / cycles_v - 1) * 100 if cycles_v else 0.0
+        info(
+            self.name,
+            f"{n_instrs} instrs, {(n_instrs - self.last_instrs) / interval:.0f} instr/s | "
+            f"{throughput} | {100 * done:.1f}%, ETA {eta:.0f}s | CPI error {cpi_error:.4f}%",
+        )
+        self.last_time = now
+        self.last_offsets = offsets
+        self.last_instrs = n_instrs
+
+
 def analyze_traces(
     target_sw: str,
     etiss_base_path: pathlib.Path,
@@ -110,20 +199,49 @@ def analyze_traces(
     addresses: dict[str, int],
     write_match: bool,
     keep_traces: bool = False,
+    keep_etiss_traces: bool = False,
     print_stages: bool = True,
-) -> tuple[float, float, float, int, int, bool]:
+    hotspots: dict[int, list] | None = None,
+    class_timing: bool = False,
+    match_format: str = "store",
+    golden_trace: pathlib.Path | None = None,
+) -> tuple[float, float, float, int, int, bool, dict[str, list[int]] | None]:
+    """Compares the traces in one streaming pass.
+
+    With `write_match`, the per-instruction results are written to `match_path`,
+    either as a columnar store directory (see matchstore.py) or, with
+    `match_format="text"`, as one text line per instruction.
+
+    If `hotspots` is given, it is filled with one entry per static ETISS PC
+    (see hotspots.py for the layout).
+
+    With `class_timing`, the ETISS cycles of each instruction are taken from the
+    timing stage of its class (see timingconfig.INSTR_CLASS_TIMING_STAGES)
+    instead of the scalar timing stage.
 
-    verilator_trace_path = verilator_base_path / f"{target_sw}_trace.txt"
+    With `golden_trace`, the Verilator trace is read from that gzip file, a link
+    to the golden trace archive (see tracearchive.py) instead of a plain trace.
+
+    With `keep_etiss_traces`, only the Verilator trace is deleted, the ETISS
+    traces may be shared with comparisons of other VLANE_WIDTHs.
+
+    The last element of the result is the per-class breakdown: integer arrays
+    indexed by class ID (see timingconfig.INSTR_CLASS_NAMES).
+    """
+
+    verilator_trace_path = golden_trace or (
+        verilator_base_path / f"{target_sw}_trace.txt"
+    )
     etiss_trace_path = etiss_base_path / f"{target_sw}_trace.txt"
     etiss_timing_path = etiss_base_path / f"{target_sw}_timing.csv"
 
-    with open(etiss_trace_path, "r", encoding="utf-8") as etiss_trace, open(
-        verilator_trace_path, "r", encoding="utf-8"
+    with open(etiss_trace_path, "r", encoding="utf-8") as etiss_trace, (
+        gzip.open(verilator_trace_path, "rt", encoding="utf-8")
+        if golden_trace
+        else open(verilator_trace_path, "r", encoding="utf-8")
     ) as verilator_trace, open(
         etiss_timing_path, "r", encoding="utf-8"
-    ) as etiss_timing, open(
-        match_path, "w", encoding="utf-8"
-    ) as match_file:
+    ) as etiss_timing, ExitStack() as match_outputs:
 
         stage_line = etiss_timing.readline()
         stages = parse_stages(stage_line)
@@ -133,7 +251,19 @@ def analyze_traces(
         etiss_timing.readline()
         verilator_trace.readline()
 
-        timing_stage_index = stages["EX_stg"]
+        timing_stage_index = stages[SCALAR_TIMING_STAGE]
+
+        # Timing column per class ID
+        class_stage_index = [timing_stage_index] * len(INSTR_CLASS_NAMES)
+        if class_timing:
+            for class_id, stage in enumerate(INSTR_CLASS_TIMING_STAGES):
+                if stage in stages:
+                    class_stage_index[class_id] = stages[stage]
+                else:
+                    warn(
+                        "CMP: analyze_traces",
+                        f"Timing stage {stage} of {INSTR_CLASS_NAMES[class_id]} not in ETISS timing, using {SCALAR_TIMING_STAGE}",
+                    )
 
         # stages_to_print = [
         #     "IF_stage",
@@ -179,11 +309,44 @@ def analyze_traces(
 
         if not (start_found_e and start_found_v):
             print("Error!")
-            return (0, 0, 0, 0, 0, False)
+            return (0, 0, 0, 0, 0, False, None)
+
+        match_file = None
+        match_store = None
+        if write_match and match_format == "text":
+            match_file = match_outputs.enter_context(
+                open(match_path, "w", encoding="utf-8")
+            )
+        elif write_match:
+            match_store = match_outputs.enter_context(
+                MatchStoreWriter(match_path, list(stages.keys()))
+            )
+            store_stage_indices = list(stages.values())
 
         n_instrs = 0
         running_cycles_v = 0
         nonzero_diffs = 0
+
+        class_ids = INSTR_CLASS_IDS
+        n_classes = len(INSTR_CLASS_NAMES)
+        class_count = [0] * n_classes
+        class_sum_diff = [0] * n_classes
+        class_abs_diff = [0] * n_classes
+        class_cycles_e = [0] * n_classes
+        class_cycles_v = [0] * n_classes
+
+        # A counter is checked per instruction, the clock only every
+        # COMPARE_PROGRESS_INSTRS instructions
+        progress = CompareProgress(
+            f"CMP: {target_sw}",
+            {
+                "ETISS trace": etiss_trace,
+                "ETISS timing": etiss_timing,
+                "Verilator trace": verilator_trace,
+            },
+        )
+        progress_every = config.COMPARE_PROGRESS_INSTRS or float("inf")
+        next_progress = progress_every
         # Analyze
         while True:
             timing_line = etiss_timing.readline()
@@ -204,18 +367,62 @@ def analyze_traces(
             running_cycles_v = cycles_v
             n_instrs += 1
 
+            class_id = class_ids.get(instr, OTHER_CLASS_ID)
+
             timing_split = timing_line.strip().split(",")
-            cycles_e = int(timing_split[timing_stage_index])
+            cycles_e = int(timing_split[class_stage_index[class_id]])
             delta_e = cycles_e - cycles_e_prev
 
             delta_diff = delta_e - delta_v
+            abs_delta_diff = abs(delta_diff)
             if delta_diff != 0:
                 nonzero_diffs = nonzero_diffs + 1
-            sum_diff = sum_diff + abs(delta_diff)
+            sum_diff = sum_diff + abs_delta_diff
+
+            class_count[class_id] += 1
+            class_sum_diff[class_id] += delta_diff
+            class_abs_diff[class_id] += abs_delta_diff
+            class_cycles_e[class_id] += delta_e
+            class_cycles_v[class_id] += delta_v
+
+            if hotspots is not None:
+                entry = hotspots.get(pc_e)
+                if entry is None:
+                    hotspots[pc_e] = [
+                        1,
+                        delta_diff,
+                        abs_delta_diff,
+                        abs_delta_diff,
+                        instr,
+                    ]
+                else:
+                    entry[COUNT] += 1
+                    entry[SUM_DIFF] += delta_diff
+                    entry[ABS_SUM_DIFF] += abs_delta_diff
+                    if abs_delta_diff > entry[MAX_DIFF]:
+                        entry[MAX_DIFF] = abs_delta_diff
 
             cycles_e_prev = cycles_e
 
-            if write_match:
+            if n_instrs >= next_progress:
+                next_progress += progress_every
+                progress.report(
+                    n_instrs,
+                    cycles_e_prev - cycles_e_start,
+                    running_cycles_v - cycles_v_start,
+                )
+
+            if match_store:
+                match_store.append(
+                    pc_e,
+                    asm_e,
+                    asm_v,
+                    delta_e,
+                    delta_v,
+                    instr,
+                    [int(timing_split[i]) for i in store_stage_indices],
+                )
+            elif match_file:
                 match_file.write(
                     f"{pc_e:08x} | {instr:10} | {asm_e:08x} | {asm_v:08x} | dE: {delta_e:4} | dV: {delta_v:4} | diff: {delta_diff:4} | "
                 )
@@ -233,21 +440,48 @@ def analyze_traces(
         cpi_v = total_cycles_v / n_instrs
         cpi_error_pct = ((cpi_e / cpi_v) - 1) * 100
 
+        class_breakdown = {
+            "count": class_count,
+            "sum_diff": class_sum_diff,
+            "abs_diff": class_abs_diff,
+            "cycles_e": class_cycles_e,
+            "cycles_v": class_cycles_v,
+        }
+
     if not keep_traces:
-        # Delete traces
         verilator_trace_path.unlink()
-        etiss_trace_path.unlink()
-        etiss_timing_path.unlink()
+        if not keep_etiss_traces:
+            delete_etiss_traces(etiss_base_path, target_sw)
 
-    return (cpi_e, cpi_v, cpi_error_pct, sum_diff, n_instrs, True)
+    return (cpi_e, cpi_v, cpi_error_pct, sum_diff, n_instrs, True, class_breakdown)
+
+
+def delete_etiss_traces(etiss_base_path: pathlib.Path, target_sw: str) -> None:
+    (etiss_base_path / f"{target_sw}_trace.txt").unlink(missing_ok=True)
+    (etiss_base_path / f"{target_sw}_timing.csv").unlink(missing_ok=True)
+
+
+def trace_dir(simulator: str, arch: str, vlen: int, vlane_width: int) -> pathlib.Path:
+    return COMPARISON_DIR / simulator / arch / f"zvl{vlen}b" / f"vlane{vlane_width}"
 
 
 def compare_fast(
-    arch, vlen, vlane_width, target_sw, keep_traces, print_stages, write_match
-) -> tuple[float, float, float, int, int, bool]:
+    arch,
+    vlen,
+    vlane_width,
+    target_sw,
+    keep_traces,
+    print_stages,
+    write_match,
+    write_hotspots: bool = False,
+    class_timing: bool = False,
+    match_format: str = "store",
+    etiss_vlane_width: int | None = None,
+    keep_etiss_traces: bool = False,
+    golden_trace: pathlib.Path | None = None,
+) -> tuple[float, float, float, int, int, bool, dict[str, list[int]] | None]:
     zvl_string = f"zvl{vlen}b"
     vlane_string = f"vlane{vlane_width}"
-    full_arch_subpath = pathlib.Path(arch) / zvl_string / vlane_string
     verilator_dump_dir = VICUNA_DIR / "build_from_other" / arch / zvl_string / "dump"
     etiss_dump_dir = (
         PERFSIM_DIR
@@ -260,31 +494,47 @@ def compare_fast(
         / "dump"
     )
 
-    comparison_dir = pathlib.Path(__file__).parent.parent / "comparison"
-    etiss_arch_path = comparison_dir / "etiss" / full_arch_subpath
-    verilator_arch_path = comparison_dir / "verilator" / full_arch_subpath
-    check_path(verilator_dump_dir)
-    check_path(etiss_dump_dir)
-    check_path(etiss_arch_path)
-    check_path(verilator_arch_path)
+    # ETISS does not model the lane width, one ETISS trace may be shared by the
+    # comparisons of all VLANE_WIDTHs
+    etiss_arch_path = trace_dir(
+        "etiss", arch, vlen, etiss_vlane_width if etiss_vlane_width else vlane_width
+    )
+    verilator_arch_path = trace_dir("verilator", arch, vlen, vlane_width)
+    # A missing input fails the comparison, it may run in a worker process of
+    # the matrix
+    missing = [
+        path
+        for path in [
+            verilator_dump_dir,
+            etiss_dump_dir,
+            etiss_arch_path / f"{target_sw}_trace.txt",
+            etiss_arch_path / f"{target_sw}_timing.csv",
+            golden_trace or verilator_arch_path / f"{target_sw}_trace.txt",
+        ]
+        if not path.exists()
+    ]
+    if missing:
+        error("compare_fast", f"Missing {', '.join(map(str, missing))}")
+        return (0, 0, 0, 0, 0, False, None)
 
     addresses, ok_addresses = read_addresses(
         target_sw, verilator_dump_dir, etiss_dump_dir
     )
     if not ok_addresses:
-        return (0, 0, 0, 0, 0, False)
+        return (0, 0, 0, 0, 0, False, None)
 
     match_path: pathlib.Path = (
-        comparison_dir
+        COMPARISON_DIR
         / "match"
         / arch
         / f"zvl{vlen}b"
         / f"vlane{vlane_width}"
-        / f"match_{target_sw}.txt"
+        / (f"match_{target_sw}.txt" if match_format == "text" else f"match_{target_sw}")
     )
     match_path.parent.mkdir(parents=True, exist_ok=True)
 
-    return analyze_traces(
+    hotspots = {} if write_hotspots else None
+    result = analyze_traces(
         target_sw,
         etiss_arch_path,
         verilator_arch_path,
@@ -292,5 +542,24 @@ def compare_fast(
         addresses,
         write_match=write_match,
         keep_traces=keep_traces,
+        keep_etiss_traces=keep_etiss_traces,
         print_stages=print_stages,
+        hotspots=hotspots,
+        class_timing=class_timing,
+        match_format=match_format,
+        golden_trace=golden_trace,
     )
+
+    if write_hotspots and result[5]:
+        hotspot_path: pathlib.Path = (
+            COMPARISON_DIR
+            / "hotspots"
+            / arch
+            / zvl_string
+            / vlane_string
+            / f"hotspots_{target_sw}.txt"
+        )
+        symbols = read_symbols(etiss_dump_dir / f"{target_sw}.dump")
+        write_hotspot_report(hotspot_path, hotspots, symbols)
+
+    return result
@@ -0,0 +1,119 @@
+import bisect
+import pathlib
+import re
+
+from comp_util import print_info
+
+# Per-PC entry layout: [count, sum of diffs, sum of abs diffs, max abs diff, instr]
+COUNT = 0
+SUM_DIFF = 1
+ABS_SUM_DIFF = 2
+MAX_DIFF = 3
+INSTR = 4
+
+TOP_PCS = 50
+TOP_FUNCTIONS = 30
+
+SYMBOL_PATTERN = re.compile(r"^([0-9a-fA-F]+) <(.+)>:\s*$")
+UNKNOWN_FUNCTION = "<unknown>"
+
+
+def read_symbols(dump_path: pathlib.Path) -> list[tuple[int, str]]:
+    """Returns the (address, name) pairs of all symbols in an objdump file, sorted by address."""
+    symbols = []
+    try:
+        with open(dump_path, "r", encoding="utf-8") as dump:
+            for line in dump:
+                match = SYMBOL_PATTERN.match(line)
+                if match:
+                    symbols.append((int(match.group(1), 16), match.group(2)))
+    except OSError:
+        print_info(f"(Hotspots) Could not read symbols from {dump_path}")
+    symbols.sort()
+    return symbols
+
+
+def find_function(symbols: list[tuple[int, str]], addresses: list[int], pc: int) -> str:
+    i = bisect.bisect_right(addresses, pc) - 1
+    if i < 0:
+        return UNKNOWN_FUNCTION
+    return symbols[i][1]
+
+
+def aggregate_functions(
+    hotspots: dict[int, list], symbols: list[tuple[int, str]]
+) -> dict[str, list[int]]:
+    """Rolls the per-PC entries up to the enclosing symbol."""
+    addresses = [address for address, _ in symbols]
+    functions: dict[str, list[int]] = {}
+    for pc, entry in hotspots.items():
+        name = find_function(symbols, addresses, pc)
+        function = functions.get(name)
+        if function is None:
+            functions[name] = [
+                entry[COUNT],
+                entry[SUM_DIFF],
+                entry[ABS_SUM_DIFF],
+                entry[MAX_DIFF],
+            ]
+        else:
+            function[COUNT] += entry[COUNT]
+            function[SUM_DIFF] += entry[SUM_DIFF]
+            function[ABS_SUM_DIFF] += entry[ABS_SUM_DIFF]
+            function[MAX_DIFF] = max(function[MAX_DIFF], entry[MAX_DIFF])
+    return functions
+
+
+def write_hotspot_report(
+    report_path: pathlib.Path,
+    hotspots: dict[int, list],
+    symbols: list[tuple[int, str]],
+    top_pcs: int = TOP_PCS,
+    top_functions: int = TOP_FUNCTIONS,
+) -> None:
+    """Writes PCs and functions ranked by their absolute sum of delta differences."""
+    addresses = [address for address, _ in symbols]
+    functions = aggregate_functions(hotspots, symbols)
+    total_abs = sum(entry[ABS_SUM_DIFF] for entry in hotspots.values())
+    total_count = sum(entry[COUNT] for entry in hotspots.values())
+
+    ranked_functions = sorted(
+        functions.items(), key=lambda item: item[1][ABS_SUM_DIFF], reverse=True
+    )
+    ranked_pcs = sorted(
+        hotspots.items(), key=lambda item: item[1][ABS_SUM_DIFF], reverse=True
+    )
+
+    longdash = 120
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as report:
+        report.write(
+            f"Instructions: {total_count} | Static PCs: {len(hotspots)} | Abs sum of differences: {total_abs}\n"
+        )
+        report.write("=" * longdash + "\n")
+        report.write("Functions:\n")
+        report.write("-" * longdash + "\n")
+        report.write(
+            f"{'Function':40} | {'Count':>10} | {'Sum diff':>10} | {'Abs sum':>10} | {'Share':>7} | {'Max':>6} | {'ADI':>8}\n"
+        )
+        report.write("-" * longdash + "\n")
+        for name, (count, sum_diff, abs_sum_diff, max_diff) in ranked_functions[
+            :top_functions
+        ]:
+            share = abs_sum_diff / total_abs * 100 if total_abs else 0
+            report.write(
+                f"{name[:40]:40} | {count:10} | {sum_diff:10} | {abs_sum_diff:10} | {share:6.2f}% | {max_diff:6} | {abs_sum_diff / count:8.4f}\n"
+            )
+        report.write("=" * longdash + "\n")
+        report.write("PCs:\n")
+        report.write("-" * longdash + "\n")
+        report.write(
+            f"{'PC':8} | {'Instr':10} | {'Function':30} | {'Count':>10} | {'Sum diff':>10} | {'Abs sum':>10} | {'Share':>7} | {'Max':>6}\n"
+        )
+        report.write("-" * longdash + "\n")
+        for pc, entry in ranked_pcs[:top_pcs]:
+            share = entry[ABS_SUM_DIFF] / total_abs * 100 if total_abs else 0
+            function = find_function(symbols, addresses, pc)
+            report.write(
+                f"{pc:08x} | {entry[INSTR]:10} | {function[:30]:30} | {entry[COUNT]:10} | {entry[SUM_DIFF]:10} | {entry[ABS_SUM_DIFF]:10} | {share:6.2f}% | {entry[MAX_DIFF]:6}\n"
+            )
@@ -0,0 +1,141 @@
+import fcntl
+import json
+import os
+import pathlib
+import statistics
+
+import config
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+HISTORY_PATH = COMPARISON_PRJ_DIR / "comparison" / "history" / "jobs.json"
+
+
+def job_name(key: tuple) -> str:
+    return "/".join(str(part) for part in key)
+
+
+def add_run(
+    jobs: dict[str, dict[str, list]],
+    name: str,
+    seconds: float,
+    usage: dict[str, float] | None,
+    timed_out: bool = False,
+) -> None:
+    job = jobs.setdefault(name, {"times": [], "usage": []})
+    if timed_out:
+        # Lower bound of the wall time, kept until the job finishes once
+        job["timed_out_s"] = max(job.get("timed_out_s", 0.0), round(seconds, 3))
+        return
+    job.pop("timed_out_s", None)
+    job["times"].append(round(seconds, 3))
+    del job["times"][: -config.JOB_HISTORY_RUNS]
+    if usage:
+        job["usage"].append(usage)
+        del job["usage"][: -config.JOB_HISTORY_RUNS]
+
+
+class JobHistory:
+    """Wall times and resource usage of past simulations, keyed by
+    (simulator, arch, vlen, vlane_width, target).
+
+    The last `config.JOB_HISTORY_RUNS` runs of every job are kept, its time
+    estimate is the median of their wall times. A job that timed out keeps its
+    timeout as a lower bound of its wall time until it finishes. Several
+    processes (workers of a distributed matrix) can record runs, each one merges
+    its runs into the history file when it saves.
+    """
+
+    def __init__(self, path: pathlib.Path = HISTORY_PATH) -> None:
+        self.path = path
+        # Job name: {"times": [s], "usage": [procmonitor usage], "timed_out_s": s}
+        self.jobs: dict[str, dict[str, list]] = {}
+        # Runs recorded since the last save: (job name, seconds, usage, timed out)
+        self.new_runs: list[tuple[str, float, dict[str, float] | None, bool]] = []
+        if path.is_file():
+            with open(path, "r", encoding="utf-8") as history_file:
+                self.jobs = json.load(history_file)
+
+    def record(
+        self,
+        key: tuple,
+        seconds: float,
+        usage: dict[str, float] | None = None,
+        timed_out: bool = False,
+    ) -> None:
+        """Records a finished run, or with `timed_out` a run killed after `seconds`."""
+        add_run(self.jobs, job_name(key), seconds, usage, timed_out)
+        self.new_runs.append((job_name(key), seconds, usage, timed_out))
+
+    def peak_rss_mb(self, key: tuple) -> float | None:
+        """Largest recorded peak RSS of a job, None without history."""
+        job = self.jobs.get(job_name(key))
+        if not job or not job["usage"]:
+            return None
+        return max(usage["peak_rss_mb"] for usage in job["usage"])
+
+    def instr_count_estimate(self, key: tuple) -> float | None:
+        simulator, _, vlen, _, target = key
+        instr_counts = config.INSTR_COUNT.get(target)
+        if not instr_counts:
+            return None
+        # Closest VLEN with a known instruction count
+        closest_vlen = min(instr_counts, key=lambda known: abs(known - vlen))
+        return instr_counts[closest_vlen] / config.SIM_INSTRS_PER_S[simulator]
+
+    def estimate(self, key: tuple) -> float:
+        """Estimated wall time in seconds, from history or the instruction count."""
+        job = self.jobs.get(job_name(key))
+        if job and (job["times"] or job.get("timed_out_s")):
+            return max(
+                statistics.median(job["times"]) if job["times"] else 0.0,
+                job.get("timed_out_s", 0.0),
+            )
+        instr_estimate = self.instr_count_estimate(key)
+        return instr_estimate if instr_estimate else config.DEFAULT_SIM_ESTIMATE_S
+
+    def timeout(self, key: tuple) -> float:
+        """Timeout of a job: TIMEOUT_FACTOR x the p95 of its recorded wall times,
+        at least TIMEOUT_MIN_S.
+
+        Jobs without history get TIMEOUT_FALLBACK_S, or TIMEOUT_FACTOR x their
+        instruction count estimate if that is longer. A job that timed out gets
+        at least TIMEOUT_RETRY_FACTOR x its last timeout. No timeout exceeds
+        TIMEOUT.
+        """
+        job = self.jobs.get(job_name(key))
+        if job and job["times"]:
+            times = job["times"]
+            p95 = (
+                statistics.quantiles(times, n=20, method="inclusive")[18]
+                if len(times) > 1
+                else times[0]
+            )
+            timeout = max(config.TIMEOUT_FACTOR * p95, config.TIMEOUT_MIN_S)
+        else:
+            instr_estimate = self.instr_count_estimate(key) or 0.0
+            timeout = max(
+                config.TIMEOUT_FACTOR * instr_estimate, config.TIMEOUT_FALLBACK_S
+            )
+        if job and job.get("timed_out_s"):
+            timeout = max(timeout, config.TIMEOUT_RETRY_FACTOR * job["timed_out_s"])
+        return min(timeout, config.TIMEOUT)
+
+    def save(self) -> None:
+        """Adds the new runs to the history file as it is now, under a lock."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            jobs = {}
+            if self.path.is_file():
+                with open(self.path, "r", encoding="utf-8") as history_file:
+                    jobs = json.load(history_file)
+            for run in self.new_runs:
+                add_run(jobs, *run)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as history_file:
+                json.dump(jobs, history_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        self.jobs = jobs
+        self.new_runs = []
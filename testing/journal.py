@@ -0,0 +1,56 @@
+import datetime
+import json
+import os
+import pathlib
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+JOURNAL_PATH = COMPARISON_PRJ_DIR / "comparison" / "journal.jsonl"
+
+
+class Journal:
+    """Append-only log of finished tasks, one JSON object per line.
+
+    Every line is flushed to disk when it is written, so after a crash or
+    reboot the journal holds every task that finished before it. Comparison
+    results are only kept for inspection, a resumed run reads them from its
+    results database session.
+    """
+
+    def __init__(self, path: pathlib.Path = JOURNAL_PATH, resume: bool = False) -> None:
+        self.path = path
+        # Key: last entry of the task
+        self.entries: dict[tuple, dict] = {}
+        if resume and path.is_file():
+            with open(path, "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of an interrupted write
+                        continue
+                    self.entries[tuple(entry["key"])] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def finished(self) -> set[tuple]:
+        """Keys of all tasks that finished successfully."""
+        return {key for key, entry in self.entries.items() if entry["state"] == "done"}
+
+    def record(self, key: tuple, state: str, elapsed: float, result=None) -> None:
+        entry = {
+            "key": list(key),
+            "state": state,
+            "elapsed": round(elapsed, 3),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        if result is not None:
+            entry["result"] = result
+        self.entries[key] = entry
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import json
+import pathlib
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from util import check_path
+
+# Column name: array typecode
+COLUMNS = {
+    "pc": "I",
+    "asm_e": "I",
+    "asm_v": "I",
+    "delta_e": "q",
+    "delta_v": "q",
+    "instr": "H",
+}
+# Row-major (n_rows x n_stages) ETISS stage cycles
+STAGES_COLUMN = "stages"
+STAGES_TYPECODE = "q"
+
+META_FILE = "meta.json"
+FLUSH_ROWS = 1 << 16
+
+
+class MatchStoreWriter:
+    """Appends matched instructions to one binary file per column.
+
+    Rows are buffered in `array.array`s and flushed every `flush_rows` rows, the
+    files can be memory-mapped by `MatchStore` afterwards.
+    """
+
+    def __init__(
+        self,
+        store_dir: pathlib.Path,
+        stage_names: list[str],
+        flush_rows: int = FLUSH_ROWS,
+    ) -> None:
+        self.store_dir = store_dir
+        self.stage_names = stage_names
+        self.flush_rows = flush_rows
+        self.n_rows = 0
+        self.instr_ids: dict[str, int] = {}
+
+        store_dir.mkdir(parents=True, exist_ok=True)
+        self.buffers = {name: array.array(code) for name, code in COLUMNS.items()}
+        self.buffers[STAGES_COLUMN] = array.array(STAGES_TYPECODE)
+        self.files = {
+            name: open(store_dir / f"{name}.bin", "wb") for name in self.buffers
+        }
+
+    def __enter__(self) -> "MatchStoreWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def append(
+        self,
+        pc: int,
+        asm_e: int,
+        asm_v: int,
+        delta_e: int,
+        delta_v: int,
+        instr: str,
+        stage_cycles: Iterable[int],
+    ) -> None:
+        instr_id = self.instr_ids.get(instr)
+        if instr_id is None:
+            instr_id = len(self.instr_ids)
+            self.instr_ids[instr] = instr_id
+
+        buffers = self.buffers
+        buffers["pc"].append(pc)
+        buffers["asm_e"].append(asm_e)
+        buffers["asm_v"].append(asm_v)
+        buffers["delta_e"].append(delta_e)
+        buffers["delta_v"].append(delta_v)
+        buffers["instr"].append(instr_id)
+        buffers[STAGES_COLUMN].extend(stage_cycles)
+
+        self.n_rows += 1
+        if len(buffers["pc"]) >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        for name, buffer in self.buffers.items():
+            buffer.tofile(self.files[name])
+            del buffer[:]
+
+    def close(self) -> None:
+        if not self.files:
+            return
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+        columns = {
+            name: np.dtype(buffer.typecode).str for name, buffer in self.buffers.items()
+        }
+        instrs = sorted(self.instr_ids, key=self.instr_ids.__getitem__)
+        with open(self.store_dir / META_FILE, "w", encoding="utf-8") as meta_file:
+            json.dump(
+                {
+                    "n_rows": self.n_rows,
+                    "columns": columns,
+                    "stages": self.stage_names,
+                    "instrs": instrs,
+                },
+                meta_file,
+                indent=2,
+            )
+
+
+class MatchStore:
+    """Read-only, memory-mapped view of a store written by `MatchStoreWriter`."""
+
+    def __init__(self, store_dir: pathlib.Path) -> None:
+        with open(store_dir / META_FILE, "r", encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+
+        self.n_rows: int = meta["n_rows"]
+        self.stage_names: list[str] = meta["stages"]
+        self.instrs: list[str] = meta["instrs"]
+        self.columns: dict[str, np.ndarray] = {}
+        for name, dtype in meta["columns"].items():
+            shape = (self.n_rows,)
+            if name == STAGES_COLUMN:
+                shape = (self.n_rows, len(self.stage_names))
+            if self.n_rows == 0 or 0 in shape:
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(
+                    store_dir / f"{name}.bin", dtype=dtype, mode="r", shape=shape
+                )
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def diff(self) -> np.ndarray:
+        return self.columns["delta_e"] - self.columns["delta_v"]
+
+    def select(
+        self,
+        pc_range: tuple[int, int] | None = None,
+        index_range: tuple[int, int] | None = None,
+        min_abs_diff: int | None = None,
+        instr: str | None = None,
+    ) -> np.ndarray:
+        """Returns the indices of all rows matching every given filter.
+
+        Ranges are half-open, `[start, end)`.
+        """
+        start, end = index_range if index_range else (0, self.n_rows)
+        start = max(start, 0)
+        end = min(end, self.n_rows)
+        if start >= end:
+            return np.arange(0)
+
+        mask = np.ones(end - start, dtype=bool)
+        if pc_range:
+            pcs = self.columns["pc"][start:end]
+            mask &= (pcs >= pc_range[0]) & (pcs < pc_range[1])
+        if min_abs_diff is not None:
+            diff = (
+                self.columns["delta_e"][start:end] - self.columns["delta_v"][start:end]
+            )
+            mask &= np.abs(diff) >= min_abs_diff
+        if instr is not None:
+            if instr not in self.instrs:
+                return np.arange(0)
+            mask &= self.columns["instr"][start:end] == self.instrs.index(instr)
+
+        return np.flatnonzero(mask) + start
+
+    def render(self, rows: Iterable[int], print_stages: bool = True) -> Iterator[str]:
+        """Renders the given rows in the layout of the text match file."""
+        columns = self.columns
+        for row in rows:
+            delta_e = int(columns["delta_e"][row])
+            delta_v = int(columns["delta_v"][row])
+            line = (
+                f"{row:10} | {int(columns['pc'][row]):08x} | {self.instrs[columns['instr'][row]]:10} | "
+                f"{int(columns['asm_e'][row]):08x} | {int(columns['asm_v'][row]):08x} | "
+                f"dE: {delta_e:4} | dV: {delta_v:4} | diff: {delta_e - delta_v:4} | "
+            )
+            if print_stages:
+                line += "".join(
+                    f"{stage}: {cycles} | "
+                    for stage, cycles in zip(
+                        self.stage_names, columns[STAGES_COLUMN][row]
+                    )
+                )
+            yield line + "\n"
+
+
+def parse_range(range_str: str) -> tuple[int, int]:
+    """Parses `start:end`, either bound may be omitted. Accepts hex with 0x prefix."""
+    start_str, _, end_str = range_str.partition(":")
+    start = int(start_str, 0) if start_str else 0
+    end = int(end_str, 0) if end_str else 1 << 64
+    return start, end
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="MatchStore",
+        description="Queries a columnar match store written by the fast comparison",
+    )
+    parser.add_argument("store", type=pathlib.Path)
+    parser.add_argument("--pc", type=parse_range, help="PC range start:end")
+    parser.add_argument("--index", type=parse_range, help="Instruction index range")
+    parser.add_argument("--min_diff", type=int, help="Minimum |dE - dV|")
+    parser.add_argument("--instr", type=str, help="ETISS instruction name")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--no_stages", action="store_true")
+    parser.add_argument("--count", action="store_true", help="Only print row count")
+    args = parser.parse_args()
+
+    check_path(args.store)
+    store = MatchStore(args.store)
+    rows = store.select(args.pc, args.index, args.min_diff, args.instr)
+    if args.count:
+        print(f"{len(rows)} of {len(store)} rows")
+        return
+    if args.limit is not None:
+        rows = rows[: args.limit]
+    for line in store.render(rows, not args.no_stages):
+        print(line, end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import pathlib
+
+PROC_DIR = pathlib.Path("/proc")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_stat(pid: str) -> tuple[int, int, int, int] | None:
+    """Returns session ID, user and system clock ticks and RSS pages of a process."""
+    try:
+        with open(PROC_DIR / pid / "stat", "r", encoding="utf-8") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, fields are counted after it
+    fields = stat[stat.rfind(")") + 2 :].split()
+    return int(fields[3]), int(fields[11]), int(fields[12]), int(fields[21])
+
+
+def read_io(pid: str) -> tuple[int, int] | None:
+    """Returns the bytes a process read from and wrote to storage."""
+    read_bytes = write_bytes = 0
+    try:
+        with open(PROC_DIR / pid / "io", "r", encoding="utf-8") as io_file:
+            for line in io_file:
+                name, _, value = line.partition(":")
+                if name == "read_bytes":
+                    read_bytes = int(value)
+                elif name == "write_bytes":
+                    write_bytes = int(value)
+    except OSError:
+        return None
+    return read_bytes, write_bytes
+
+
+class ProcessTreeMonitor:
+    """Samples all processes of a session (a run script and everything it started).
+
+    The peak RSS is the largest sum over all processes of one sample. CPU time
+    and I/O are the last sampled values of every process that was seen, work
+    done after the last sample of a process is missed.
+    """
+
+    def __init__(self, session_id: int) -> None:
+        self.session_id = session_id
+        self.peak_rss_bytes = 0
+        self.cpu_ticks: dict[str, tuple[int, int]] = {}
+        self.io_bytes: dict[str, tuple[int, int]] = {}
+
+    def sample(self) -> None:
+        rss_bytes = 0
+        for proc_path in PROC_DIR.iterdir():
+            pid = proc_path.name
+            if not pid.isdigit():
+                continue
+            stat = read_stat(pid)
+            if stat is None or stat[0] != self.session_id:
+                continue
+            _, user_ticks, sys_ticks, rss_pages = stat
+            rss_bytes += rss_pages * PAGE_SIZE
+            self.cpu_ticks[pid] = (user_ticks, sys_ticks)
+            io = read_io(pid)
+            if io is not None:
+                self.io_bytes[pid] = io
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes)
+
+    async def run(self, interval: float) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def usage(self) -> dict[str, float]:
+        return {
+            "peak_rss_mb": round(self.peak_rss_bytes / (1 << 20), 1),
+            "user_s": sum(user for user, _ in self.cpu_ticks.values()) / CLOCK_TICKS,
+            "sys_s": sum(sys for _, sys in self.cpu_ticks.values()) / CLOCK_TICKS,
+            "read_mb": round(
+                sum(read for read, _ in self.io_bytes.values()) / (1 << 20), 1
+            ),
+            "write_mb": round(
+                sum(write for _, write in self.io_bytes.values()) / (1 << 20), 1
+            ),
+        }
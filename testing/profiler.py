@@ -0,0 +1,103 @@
+import cProfile
+import io
+import pathlib
+import pstats
+import threading
+import tracemalloc
+from contextlib import ExitStack
+from typing import Callable
+
+import config
+from util import info
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+PROFILE_DIR = COMPARISON_PRJ_DIR / "comparison" / "profile"
+
+
+class SnapshotSampler:
+    """Keeps the tracemalloc snapshot taken at the largest traced memory, sampled
+    every PROFILE_MEM_INTERVAL_S from a thread. The allocations of a function are
+    freed when it returns, a snapshot after it would miss them."""
+
+    def __init__(self) -> None:
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.snapshot_bytes = -1
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self) -> None:
+        current_bytes, _ = tracemalloc.get_traced_memory()
+        if current_bytes > self.snapshot_bytes:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current_bytes
+
+    def run(self) -> None:
+        while not self.stop_event.wait(config.PROFILE_MEM_INTERVAL_S):
+            self.sample()
+
+    def __enter__(self) -> "SnapshotSampler":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+
+def profile_call(
+    func: Callable, name: str, profile: bool = True, profile_mem: bool = False
+):
+    """Calls `func` under cProfile and / or tracemalloc and returns its result.
+
+    The profile is stored as comparison/profile/<name>.pstats (open with
+    `python -m pstats` or snakeviz), the largest allocations as
+    <name>_alloc.txt. The hottest functions and allocations are printed.
+    """
+    fname = f"profile {name}"
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile() if profile else None
+    sampler = SnapshotSampler() if profile_mem else None
+    try:
+        with ExitStack() as stack:
+            if sampler:
+                tracemalloc.start(config.PROFILE_MEM_FRAMES)
+                stack.enter_context(sampler)
+            if profiler:
+                stack.enter_context(profiler)
+            result = func()
+    except BaseException:
+        # Do not slow down later calls in this process
+        tracemalloc.stop()
+        raise
+
+    if profiler:
+        stats_path = PROFILE_DIR / f"{name}.pstats"
+        profiler.dump_stats(stats_path)
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_text)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(config.PROFILE_TOP_FUNCTIONS)
+        info(fname, f"Hottest functions (profile: {stats_path})")
+        # Skip the header, the table starts after the first empty line
+        print(stats_text.getvalue().partition("\n\n")[2].rstrip())
+    if sampler:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        top_stats = sampler.snapshot.statistics("lineno")
+        alloc_path = PROFILE_DIR / f"{name}_alloc.txt"
+        with open(alloc_path, "w", encoding="utf-8") as alloc_file:
+            alloc_file.write(
+                f"Peak traced memory: {peak_bytes / (1 << 20):.1f} MB, "
+                f"snapshot at {sampler.snapshot_bytes / (1 << 20):.1f} MB\n"
+            )
+            for stat in top_stats[: config.PROFILE_TOP_ALLOCATIONS]:
+                alloc_file.write(f"{stat}\n")
+        info(
+            fname,
+            f"Peak traced memory {peak_bytes / (1 << 20):.1f} MB, largest allocations (all: {alloc_path})",
+        )
+        for stat in top_stats[: config.PROFILE_TOP_FUNCTIONS]:
+            print(f"\t{stat}")
+    return result
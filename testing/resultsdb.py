@@ -0,0 +1,379 @@
+import argparse
+import datetime
+import json
+import pathlib
+import sqlite3
+
+import config
+from buildcache import PROJECT_ROOT_DIR, git_revision
+from timingconfig import INSTR_CLASS_NAMES
+from util import check_path, info, success, warn
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+DB_PATH = (
+    pathlib.Path(config.RESULTS_DB)
+    if config.RESULTS_DB
+    else COMPARISON_PRJ_DIR / "comparison" / "results.db"
+)
+
+# Source trees whose checked out revision is stored with every session
+REVISION_DIRS = {
+    "etiss_rev": PROJECT_ROOT_DIR / "Perfsim",
+    "rtl_rev": PROJECT_ROOT_DIR / "Vicuna2",
+    "tests_rev": PROJECT_ROOT_DIR / "RISCV_Programs",
+    "testing_rev": COMPARISON_PRJ_DIR,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    command TEXT,
+    etiss_rev TEXT,
+    rtl_rev TEXT,
+    tests_rev TEXT,
+    testing_rev TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    simulator TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    vlen INTEGER NOT NULL,
+    vlane_width INTEGER,
+    target TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    wall_s REAL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS comparisons (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    arch TEXT NOT NULL,
+    vlen INTEGER NOT NULL,
+    vlane_width INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    wall_s REAL,
+    cpi_e REAL,
+    cpi_v REAL,
+    cpi_error REAL,
+    sum_diff INTEGER,
+    adi REAL,
+    n_instrs INTEGER,
+    class_breakdown TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comparisons_config
+    ON comparisons (arch, vlen, vlane_width, target);
+"""
+
+
+def now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class ResultsDB:
+    """Results of all runs and comparisons, grouped in sessions (one invocation
+    of run-test-matrix.py, continued by --resume)."""
+
+    def __init__(self, path: pathlib.Path = DB_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def start_session(self, command: str) -> int:
+        revisions = {name: git_revision(path) for name, path in REVISION_DIRS.items()}
+        cursor = self.db.execute(
+            "INSERT INTO sessions (started, command, etiss_rev, rtl_rev, tests_rev, "
+            "testing_rev) VALUES (?, ?, ?, ?, ?, ?)",
+            (now(), command, *revisions.values()),
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def last_session(self) -> int | None:
+        row = self.db.execute("SELECT MAX(id) FROM sessions").fetchone()
+        return row[0]
+
+    def add_run(
+        self,
+        session_id: int,
+        simulator: str,
+        arch: str,
+        vlen: int,
+        vlane_width: int | None,
+        target: str,
+        ok: bool,
+        wall_s: float,
+    ) -> None:
+        self.db.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (session_id, simulator, arch, vlen, vlane_width, target, ok, wall_s, now()),
+        )
+        self.db.commit()
+
+    def add_comparison(
+        self,
+        session_id: int,
+        args: tuple[str, int, int, str],
+        result: tuple | None,
+        wall_s: float,
+    ) -> None:
+        """Stores a compare_fast result, None if the comparison did not return."""
+        metrics = (None,) * 7
+        ok = False
+        if result is not None:
+            cpi_e, cpi_v, cpi_error, sum_diff, n_instrs, ok, class_breakdown = result
+            if ok:
+                metrics = (
+                    cpi_e,
+                    cpi_v,
+                    cpi_error,
+                    sum_diff,
+                    sum_diff / n_instrs,
+                    n_instrs,
+                    json.dumps(class_breakdown) if class_breakdown else None,
+                )
+        self.db.execute(
+            "INSERT INTO comparisons VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (session_id, *args, ok, wall_s, *metrics, now()),
+        )
+        self.db.commit()
+
+    def sessions(self, limit: int) -> list[sqlite3.Row]:
+        return self.db.execute(
+            "SELECT s.*, COUNT(c.ok) AS compared, SUM(c.ok) AS passed FROM sessions s "
+            "LEFT JOIN comparisons c ON c.session_id = s.id "
+            "GROUP BY s.id ORDER BY s.id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def comparisons(
+        self,
+        session_id: int | None = None,
+        arch: str | None = None,
+        vlen: int | None = None,
+        vlane_width: int | None = None,
+        target: str | None = None,
+    ) -> list[sqlite3.Row]:
+        """Comparisons matching all given filters, with the revisions of their
+        session, oldest first."""
+        filters = {
+            "c.session_id": session_id,
+            "c.arch": arch,
+            "c.vlen": vlen,
+            "c.vlane_width": vlane_width,
+            "c.target": target,
+        }
+        used = {column: value for column, value in filters.items() if value is not None}
+        where = " AND ".join(f"{column} = ?" for column in used) or "1"
+        return self.db.execute(
+            "SELECT c.*, s.etiss_rev, s.rtl_rev FROM comparisons c "
+            f"JOIN sessions s ON c.session_id = s.id WHERE {where} "
+            "ORDER BY c.arch, c.vlen, c.vlane_width, c.target, c.rowid",
+            tuple(used.values()),
+        ).fetchall()
+
+    def failed_configs(self, session_id: int) -> set[tuple]:
+        """(arch, VLEN, VLANE_WIDTH, target) of all failed runs and comparisons of a
+        session, the VLANE_WIDTH of ETISS runs is None."""
+        rows = self.db.execute(
+            "SELECT arch, vlen, vlane_width, target FROM runs "
+            "WHERE session_id = ? AND NOT ok UNION "
+            "SELECT arch, vlen, vlane_width, target FROM comparisons "
+            "WHERE session_id = ? AND NOT ok",
+            (session_id, session_id),
+        ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def table_rows(self, session_id: int) -> list[sqlite3.Row]:
+        """Last comparison of every configuration in a session."""
+        latest = {}
+        for row in self.comparisons(session_id):
+            latest[(row["arch"], row["vlen"], row["vlane_width"], row["target"])] = row
+        return list(latest.values())
+
+    def regressions(
+        self, head: int, base: int | None, threshold: float
+    ) -> list[tuple[sqlite3.Row, sqlite3.Row, str]]:
+        """Configurations that passed in the base session and fail in the head
+        session, or whose absolute CPI error grew by more than `threshold`
+        percentage points.
+
+        Without a base session, every configuration is compared against its
+        last result from an earlier session.
+        """
+        previous = {}
+        latest = {}
+        for row in self.comparisons():
+            config_key = (row["arch"], row["vlen"], row["vlane_width"], row["target"])
+            if row["session_id"] == head:
+                latest[config_key] = row
+            elif row["session_id"] < head and (
+                base is None or row["session_id"] == base
+            ):
+                previous[config_key] = row
+
+        found = []
+        for config_key, row in latest.items():
+            before = previous.get(config_key)
+            if before is None or not before["ok"]:
+                continue
+            if not row["ok"]:
+                found.append((before, row, "comparison fails"))
+            elif abs(row["cpi_error"]) - abs(before["cpi_error"]) > threshold:
+                found.append(
+                    (
+                        before,
+                        row,
+                        f"CPI error {before['cpi_error']:.4f}% -> {row['cpi_error']:.4f}%",
+                    )
+                )
+        return found
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def escape(text: str) -> str:
+    return text.replace("_", "\\_")
+
+
+def write_tables(rows: list[sqlite3.Row], table_path: pathlib.Path) -> None:
+    """Writes the LaTeX result and per instruction class tables of passed
+    comparisons."""
+    fname = "write_tables"
+    rows = [row for row in rows if row["ok"]]
+
+    info(fname, "Generate table")
+    with open(table_path, "w", encoding="utf-8") as table_file:
+        table_file.write("\\begin{center}\n")
+        table_file.write("\\begin{tabular}{ c c c c c c c }\n")
+        table_file.write(
+            "Target & VLEN & VLANE\\_WIDTH & CPI ETISS & CPI Verilator & Error & ADI & # Instrs."
+        )
+        for row in rows:
+            table_file.write(
+                f" \\\\\n{escape(row['target'])} & {row['vlen']} & {row['vlane_width']} & {row['cpi_e']:.4f} & {row['cpi_v']:.4f} & {row['cpi_error']:.4f} \\% & {row['adi']:.4f} & {row['n_instrs']}"
+            )
+        table_file.write("\n\\end{tabular}\n\\end{center}\n")
+
+        # Per instruction class breakdown, CPI columns are the contribution
+        # of the class to the total CPI
+        table_file.write("\\begin{center}\n")
+        table_file.write("\\begin{tabular}{ c c c c c c c c c }\n")
+        table_file.write(
+            "Target & VLEN & VLANE\\_WIDTH & Class & # Instrs. & CPI ETISS & CPI Verilator & Sum Diff & ADI"
+        )
+        for row in rows:
+            if not row["class_breakdown"]:
+                continue
+            breakdown = json.loads(row["class_breakdown"])
+            for class_id, class_name in enumerate(INSTR_CLASS_NAMES):
+                count = breakdown["count"][class_id]
+                if count == 0:
+                    continue
+                class_cpi_e = breakdown["cycles_e"][class_id] / row["n_instrs"]
+                class_cpi_v = breakdown["cycles_v"][class_id] / row["n_instrs"]
+                class_adi = breakdown["abs_diff"][class_id] / count
+                table_file.write(
+                    f" \\\\\n{escape(row['target'])} & {row['vlen']} & {row['vlane_width']} & {escape(class_name)} & {count} & {class_cpi_e:.4f} & {class_cpi_v:.4f} & {breakdown['sum_diff'][class_id]} & {class_adi:.4f}"
+                )
+        table_file.write("\n\\end{tabular}\n\\end{center}\n")
+
+
+def format_result(row: sqlite3.Row) -> str:
+    if not row["ok"]:
+        return "failed"
+    return (
+        f"CPI ETISS {row['cpi_e']:.4f} | CPI RTL {row['cpi_v']:.4f} | "
+        f"Error {row['cpi_error']:.4f}% | ADI {row['adi']:.4f} | {row['n_instrs']} instrs"
+    )
+
+
+def main() -> None:
+    fname = "ResultsDB"
+    parser = argparse.ArgumentParser(
+        prog=fname,
+        description="Queries the results database written by run-test-matrix.py",
+    )
+    parser.add_argument("--db", type=pathlib.Path, default=DB_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sessions_parser = subparsers.add_parser("sessions", help="List the last sessions")
+    sessions_parser.add_argument("--limit", type=int, default=20)
+
+    trend_parser = subparsers.add_parser(
+        "trend", help="Results of configurations across sessions"
+    )
+    trend_parser.add_argument("--arch", type=str)
+    trend_parser.add_argument("--vlen", type=int)
+    trend_parser.add_argument("--vlane", type=int)
+    trend_parser.add_argument("--target", type=str)
+
+    regressions_parser = subparsers.add_parser(
+        "regressions", help="Configurations that got worse in a session"
+    )
+    regressions_parser.add_argument(
+        "--head", type=int, help="Session to check (default: last)"
+    )
+    regressions_parser.add_argument(
+        "--base", type=int, help="Session to compare against (default: last result)"
+    )
+    regressions_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=config.REGRESSION_THRESHOLD_PCT,
+        help="Allowed growth of the absolute CPI error in percentage points",
+    )
+
+    table_parser = subparsers.add_parser("table", help="Write the LaTeX tables")
+    table_parser.add_argument("output", type=pathlib.Path)
+    table_parser.add_argument(
+        "--session", type=int, help="Session to tabulate (default: last)"
+    )
+    args = parser.parse_args()
+
+    check_path(args.db)
+    db = ResultsDB(args.db)
+
+    if args.command == "sessions":
+        for row in db.sessions(args.limit):
+            print(
+                f"{row['id']:>5} {row['started']} {row['passed'] or 0}/{row['compared']} passed | "
+                f"ETISS {row['etiss_rev']} | RTL {row['rtl_rev']} | tests {row['tests_rev']}"
+            )
+    elif args.command == "trend":
+        last_config = None
+        for row in db.comparisons(None, args.arch, args.vlen, args.vlane, args.target):
+            config_key = (row["arch"], row["vlen"], row["vlane_width"], row["target"])
+            if config_key != last_config:
+                print(
+                    f"{row['target']} on {row['arch']}_zvl{row['vlen']}b, VLANE_WIDTH {row['vlane_width']}"
+                )
+                last_config = config_key
+            print(
+                f"\t{row['session_id']:>5} {row['timestamp']} ETISS {row['etiss_rev']}: {format_result(row)}"
+            )
+    elif args.command == "regressions":
+        head = args.head or db.last_session()
+        regressions = db.regressions(head, args.base, args.threshold)
+        for before, after, reason in regressions:
+            warn(
+                fname,
+                f"{after['target']} on {after['arch']}_zvl{after['vlen']}b, VLANE_WIDTH {after['vlane_width']}: "
+                f"{reason} (session {before['session_id']}, ETISS {before['etiss_rev']} -> "
+                f"session {after['session_id']}, ETISS {after['etiss_rev']})",
+            )
+        if not regressions:
+            success(fname, f"No regressions in session {head}")
+    elif args.command == "table":
+        write_tables(db.table_rows(args.session or db.last_session()), args.output)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
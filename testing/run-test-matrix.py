@@ -1,13 +1,38 @@
 #!/usr/bin/env python3
 
 import argparse
-import multiprocessing as mp
+import asyncio
 import pathlib
 import subprocess
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 
+import buildcache
 import config
+import distributed
+import profiler
+import simcache
+import timeline
+import tracearchive
 from util import check_path, error, info, success, warn
-from fastcomparison import compare_fast
+from configspace import (
+    Config,
+    enumerate_configs,
+    etiss_configs,
+    etiss_vlane_width,
+    parse_int_list,
+    parse_list,
+    rtl_configs,
+    test_build_configs,
+)
+from fastcomparison import compare_fast, delete_etiss_traces, trace_dir
+from jobhistory import JobHistory
+from journal import Journal
+from resultsdb import ResultsDB, write_tables
+from scheduler import ResourceBudget, run_process, stream_process
+from taskgraph import TaskGraph
 
 
 class BuildType(str):
@@ -17,13 +42,29 @@ class BuildType(str):
 
 
 ETISS_SUCCESS_STRING = "Success"
-ETISS_FAIL_STRING = "Fail"
+# A line starting with the word Fail, not e.g. "Failed to load plugin"
+ETISS_FAIL_STRING = r"^Fail\b"
 ETISS_ERROR_STRING = "ETISS: Error"
 
 VERILATOR_SUCCESS_STRING = "Output Match"
 VERILATOR_FAIL_STRING = "Output Mismatch"
 VERILATOR_INTERRUPT_STRING = "Interrupt Called"
 
+# Markers searched for in the simulator output (regular expressions, see
+# stream_process), a run is killed as soon as one of its stop markers appears
+SIM_MARKERS = {
+    "etiss": [ETISS_SUCCESS_STRING, ETISS_FAIL_STRING, ETISS_ERROR_STRING],
+    "verilator": [
+        VERILATOR_SUCCESS_STRING,
+        VERILATOR_FAIL_STRING,
+        VERILATOR_INTERRUPT_STRING,
+    ],
+}
+SIM_STOP_MARKERS = {
+    "etiss": [ETISS_FAIL_STRING, ETISS_ERROR_STRING],
+    "verilator": [VERILATOR_FAIL_STRING, VERILATOR_INTERRUPT_STRING],
+}
+
 SRC_DIR = pathlib.Path(__file__).parent.resolve()
 COMPARISON_PRJ_DIR = SRC_DIR.parent
 PROJECT_ROOT_DIR = COMPARISON_PRJ_DIR.parent
@@ -33,6 +74,7 @@ VERILATOR_PRJ_SRC = PROJECT_ROOT_DIR / "Vicuna2"
 TEST_PRJ_SRC = PROJECT_ROOT_DIR / "RISCV_Programs"
 COMPARISON_DIR = COMPARISON_PRJ_DIR / "comparison"
 TABLE_DIR = COMPARISON_DIR / "table"
+LOG_DIR = COMPARISON_DIR / "logs"
 # RUNTIME_DIR = COMPARISON_DIR / "runtime"
 
 check_path(PROJECT_ROOT_DIR)
@@ -50,21 +92,63 @@ VALID_VLENS = [64, 128, 256, 512, 1024]
 VALID_ARCHS = ["rv32im_zicsr", "rv32im_zve32x", "rv32imf_zve32f"]
 
 VALID_VLANE_WIDTHS = [32, 64, 128, 256, 512]
-VLANE_WIDTH_COMBINATIONS = {
-    # VLEN : [legal VLANE_Ws]
-    64: [32],
-    128: [32, 64],
-    256: [32, 64, 128],
-    512: [32, 64, 128, 256],
-    1024: [32, 64, 128, 256, 512],
-}
 
-def build_rtl(arch: str, vlen: int, vlane_width: int, optargs: list[str]) -> bool:
+
+async def lookup_build(
+    kind: str, inputs: dict, src_dirs: list[pathlib.Path], optargs: list[str]
+) -> tuple[tuple[str, dict] | None, bool]:
+    """Returns the build cache entry of a build and whether it is cached.
+
+    Clean builds are never restored, but their artifacts are still stored.
+    """
+    entry = await asyncio.to_thread(buildcache.build_key, kind, inputs, src_dirs)
+    if entry is None or "--clean" in optargs:
+        return entry, False
+    return entry, buildcache.contains(kind, entry[0])
+
+
+def check_rtl_models(rtl_models: list[tuple[str, int, int]], when: str) -> bool:
+    """Checks that the built RTL models are where config.RTL_ARTIFACT_DIRS
+    points, the build and simulation caches and the golden archive key on them.
+
+    Only warns, the caller does not cache the builds and simulations of missing
+    models.
+    """
+    fname = "check_rtl_models"
+    missing = [
+        model_dir
+        for arch, vlen, vlane_width in rtl_models
+        for model_dir in buildcache.artifact_dirs(
+            config.RTL_ARTIFACT_DIRS, arch=arch, vlen=vlen, vlane_width=vlane_width
+        )
+        if not model_dir.is_dir()
+    ]
+    if missing:
+        warn(
+            fname,
+            f"RTL model directories missing {when}: {', '.join(map(str, missing))}",
+        )
+        warn(
+            fname,
+            "config.RTL_ARTIFACT_DIRS has to match the output directories of "
+            f"{VERILATOR_PRJ_SRC / 'build-rtl.sh'}, not caching RTL builds, "
+            "Verilator simulations and golden traces of these models",
+        )
+        return False
+    return True
+
+
+async def build_rtl(
+    arch: str,
+    vlen: int,
+    vlane_width: int,
+    optargs: list[str],
+    budget: ResourceBudget,
+    log_path: pathlib.Path,
+    use_cache: bool = True,
+    check_models: bool = False,
+) -> bool:
     fname = "build_rtl"
-    info(
-        fname,
-        f"Building RTL model for arch {arch}, VLEN {vlen}, VLANE_WIDTH {vlane_width}",
-    )
     if vlen not in VALID_VLENS:
         error(fname, f"Illegal VLEN {vlen}")
     if arch not in VALID_ARCHS:
@@ -84,49 +168,109 @@ def build_rtl(arch: str, vlen: int, vlane_width: int, optargs: list[str]) -> boo
 
     build_args += optargs
 
-    proc = subprocess.run(args=build_args, capture_output=True, encoding="utf-8")
-    if proc.stderr:
-        stderr_out = f"\n{proc.stderr}" if config.PRINT_STDERR else ""
-        error(fname, f"Process returned stderr{stderr_out}")
+    model_string = f"arch {arch}, VLEN {vlen}, VLANE_WIDTH {vlane_width}"
+    cache_entry = None
+    if use_cache:
+        artifacts = buildcache.artifact_dirs(
+            config.RTL_ARTIFACT_DIRS, arch=arch, vlen=vlen, vlane_width=vlane_width
+        )
+        inputs = {
+            "arch": arch,
+            "vlen": vlen,
+            "vlane_width": vlane_width,
+            "optargs": [arg for arg in optargs if arg != "--clean"],
+            "verilator": buildcache.tool_version(config.RTL_TOOL_VERSION_ARGS),
+        }
+        cache_entry, cached = await lookup_build(
+            "rtl", inputs, [VERILATOR_PRJ_SRC], optargs
+        )
+        if cached and await asyncio.to_thread(
+            buildcache.restore, "rtl", cache_entry[0], artifacts
+        ):
+            success(fname, f"{model_string}: Restored from build cache")
+            return True
+
+    async with budget.reserve(
+        config.RTL_BUILD_THREADS, config.RTL_BUILD_MEM_MB.get(vlen, 0)
+    ):
+        info(fname, f"Building RTL model for {model_string}")
+        with timeline.span(
+            f"build_rtl {arch}_zvl{vlen}b vlane{vlane_width}",
+            "build_rtl",
+            ("build_rtl", arch, vlen, vlane_width),
+        ):
+            _, stdout, stderr = await run_process(build_args)
+    write_log(log_path, build_args, stdout, stderr)
+    if stderr:
+        stderr_out = f"\n{stderr}" if config.PRINT_STDERR else ""
+        error(fname, f"{model_string}: Process returned stderr{stderr_out}")
         return False
-    success(fname, "Success")
+    if check_models and not check_rtl_models(
+        [(arch, vlen, vlane_width)], "after build-rtl.sh"
+    ):
+        # Simulations of the model are not cached either, their keys need
+        # the model directory
+        cache_entry = None
+    if cache_entry:
+        await asyncio.to_thread(buildcache.store, "rtl", *cache_entry, artifacts)
+    success(fname, f"{model_string}: Success")
     return True
 
 
-def build_rtl_list(test_config: dict, optargs: list[str]) -> bool:
-    info("build_rtl_list", "Building RTL models")
-    all_successful = True
-    archs = test_config.keys()
-    for arch in archs:
-        if test_config[arch]["skip"]:
-            continue
-        vlens = test_config[arch]["vlens"]
-        vlane_widths = test_config[arch]["vlane_widths"]
-        for vlen in vlens:
-            for vlane_width in vlane_widths:
-                if vlane_width not in VLANE_WIDTH_COMBINATIONS[vlen]:
-                    # Skip illegal VLEN / VLANE_W combinations
-                    continue
-                if not build_rtl(arch, vlen, vlane_width, optargs):
-                    all_successful = False
+def add_rtl_builds(
+    graph: TaskGraph,
+    configs: list[Config],
+    optargs: list[str],
+    budget: ResourceBudget,
+    use_cache: bool,
+    check_models: bool,
+) -> None:
+    for arch, vlen, vlane_width in rtl_configs(configs):
+        log_path = LOG_DIR / "build" / f"rtl_{arch}_zvl{vlen}b_vlane{vlane_width}.log"
+        graph.add(
+            ("build_rtl", arch, vlen, vlane_width),
+            f"build_rtl {arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width} (log: {log_path})",
+            partial(
+                build_rtl,
+                arch,
+                vlen,
+                vlane_width,
+                optargs,
+                budget,
+                log_path,
+                use_cache,
+                check_models,
+            ),
+        )
 
-    return all_successful
 
+def write_log(log_path: pathlib.Path, args: list, stdout: str, stderr: str) -> None:
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        log_file.write(" ".join(str(arg) for arg in args) + "\n")
+        log_file.write("=" * 20 + " stdout " + "=" * 20 + "\n")
+        log_file.write(stdout)
+        log_file.write("=" * 20 + " stderr " + "=" * 20 + "\n")
+        log_file.write(stderr)
 
-def build_test(
+
+async def build_test(
     arch: str,
     abi: str,
     vlen: int,
     build_type: BuildType,
     compiler: str,
     target: str,
+    programs: list[str],
     optargs: list[str],
+    budget: ResourceBudget,
+    log_path: pathlib.Path,
+    use_cache: bool = True,
 ) -> bool:
+    """Builds the CMake target `target`, `programs` are the programs of it the
+    selected configurations run. They are cached one by one, the build
+    directories are shared by all targets."""
     fname = "build_test"
-    info(
-        fname,
-        f"Building tests for {arch}, VLEN {vlen} with {compiler.upper()}, {build_type if build_type != "" else "release"}",
-    )
     if vlen not in VALID_VLENS:
         error(fname, f"Illegal VLEN {vlen}")
     if arch not in VALID_ARCHS:
@@ -152,45 +296,151 @@ def build_test(
 
     build_args += optargs
 
-    proc = subprocess.run(args=build_args, capture_output=True, encoding="utf-8")
-    if config.PRINT_BUILD_STDOUT and proc.stdout:
-        print(proc.stdout)
-    if proc.stderr:
-        stderr_out = f"\n{proc.stderr}" if config.PRINT_STDERR else ""
-        error(fname, f"Process returned stderr{stderr_out}")
-        if config.STOP_ON_ERROR:
-            exit(1)
+    build_string = f"{arch}, VLEN {vlen}"
+    # Program: cache entry
+    cache_entries = {}
+    if use_cache:
+        inputs = {
+            "arch": arch,
+            "abi": abi,
+            "vlen": vlen,
+            "build_type": build_type,
+            "compiler": compiler,
+            "optargs": [arg for arg in optargs if arg != "--clean"],
+            "compiler_version": buildcache.tool_version(
+                config.COMPILER_VERSION_ARGS[compiler]
+            ),
+        }
+        lookups = await asyncio.gather(
+            *[
+                lookup_build(
+                    "test", dict(inputs, program=program), [TEST_PRJ_SRC], optargs
+                )
+                for program in programs
+            ]
+        )
+        cache_entries = {
+            program: entry
+            for program, (entry, _) in zip(programs, lookups)
+            if entry is not None
+        }
+        # Restore only if the build can be skipped for all programs
+        if lookups and all(cached for _, cached in lookups):
+            restored = [
+                await asyncio.to_thread(buildcache.restore_files, "test", entry[0])
+                for entry in cache_entries.values()
+            ]
+            if all(restored):
+                success(fname, f"{build_string}: Restored from build cache")
+                return True
+
+    async with budget.reserve(config.TEST_BUILD_THREADS, config.TEST_BUILD_MEM_MB):
+        info(
+            fname,
+            f"Building tests for {build_string} with {compiler.upper()}, {build_type if build_type != "" else "release"}",
+        )
+        with timeline.span(
+            f"build_test {arch}_zvl{vlen}b", "build_test", ("build_test", arch, vlen)
+        ):
+            _, stdout, stderr = await run_process(build_args)
+    write_log(log_path, build_args, stdout, stderr)
+
+    # Print the whole output at once, so parallel builds do not interleave
+    if config.PRINT_BUILD_STDOUT and stdout:
+        print(stdout)
+    if stderr:
+        stderr_out = f"\n{stderr}" if config.PRINT_STDERR else ""
+        error(fname, f"{build_string}: Process returned stderr{stderr_out}")
         return False
 
-    success(fname, "Success")
+    for program, cache_entry in cache_entries.items():
+        files = buildcache.artifact_files(
+            config.TEST_ARTIFACT_FILES, arch=arch, vlen=vlen, target=program
+        )
+        await asyncio.to_thread(buildcache.store_files, "test", *cache_entry, files)
+    success(fname, f"{build_string}: Success")
     return True
 
 
-def build_all_tests(
+def add_test_builds(
+    graph: TaskGraph,
     test_config: dict,
+    configs: list[Config],
     build_type: BuildType,
     compiler: str,
     build_target: str,
     optargs: list[str],
-) -> bool:
-    info("build_all_tests", "Building tests")
-    all_successful = True
-    archs = test_config.keys()
-    for arch in archs:
+    budget: ResourceBudget,
+    use_cache: bool,
+) -> None:
+    for arch, vlen in test_build_configs(configs):
         abi = test_config[arch]["abi"]
-        if test_config[arch]["skip"]:
-            continue
-        vlens = test_config[arch]["vlens"]
-        for vlen in vlens:
-            all_successful &= build_test(
-                arch, abi, vlen, build_type, compiler, build_target, optargs
-            )
+        log_path = LOG_DIR / "build" / f"tests_{arch}_zvl{vlen}b.log"
+        programs = sorted(
+            {
+                target
+                for config_arch, config_vlen, _, target in configs
+                if (config_arch, config_vlen) == (arch, vlen)
+            }
+        )
+        graph.add(
+            ("build_test", arch, vlen),
+            f"build_test {arch}_zvl{vlen}b (log: {log_path})",
+            partial(
+                build_test,
+                arch,
+                abi,
+                vlen,
+                build_type,
+                compiler,
+                build_target,
+                programs,
+                optargs,
+                budget,
+                log_path,
+                use_cache,
+            ),
+        )
 
-    return all_successful
+
+def run_log_path(
+    simulator: str, arch: str, vlen: int, vlane_width: int, target: str
+) -> pathlib.Path:
+    return (
+        LOG_DIR
+        / "run"
+        / simulator
+        / f"{target}_{arch}_zvl{vlen}b_vlane{vlane_width}.log"
+    )
 
 
-def run_test(
-    arch: str, vlen: int, vlane_width: int, target: str, simulator: str
+def check_output(simulator: str, found: set[str]) -> tuple[str | None, bool]:
+    """Returns why a run failed (None if it passed) and if the success string was
+    found, given the markers found in its stdout.
+    """
+    if simulator == "etiss":
+        if ETISS_FAIL_STRING in found:
+            return "By program report", False
+        if ETISS_ERROR_STRING in found:
+            return "ETISS error", False
+        return None, ETISS_SUCCESS_STRING in found
+    if VERILATOR_FAIL_STRING in found:
+        return "Output Mismatch", False
+    if VERILATOR_INTERRUPT_STRING in found:
+        return "Interrupt Called", False
+    return None, VERILATOR_SUCCESS_STRING in found
+
+
+async def run_test(
+    arch: str,
+    vlen: int,
+    vlane_width: int,
+    target: str,
+    simulator: str,
+    budget: ResourceBudget,
+    use_cache: bool = False,
+    use_golden: bool = False,
+    history: JobHistory | None = None,
 ) -> bool:
     if simulator not in ["etiss", "verilator"]:
         error("run_test", f"Invalid simulator {simulator}")
@@ -198,7 +448,6 @@ def run_test(
     full_arch_string = f"{arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width}"
     target_sw_width = 15
     error_msg_header = f"\tError {target:{target_sw_width + 2}} on {full_arch_string}"
-    info(fname, f"\tRunning {target:{target_sw_width}} on {full_arch_string}")
 
     run_script_name = "run-target.sh"
     run_script_dir = PERFSIM_PRJ_SRC if simulator == "etiss" else VERILATOR_PRJ_SRC
@@ -215,219 +464,452 @@ def run_test(
         "--target",
         target,
     ]
-    try:
-        proc = subprocess.run(
-            args=run_args,
-            capture_output=True,
-            encoding="utf-8",
-            timeout=config.TIMEOUT,
+
+    sim_trace_dir = trace_dir(simulator, arch, vlen, vlane_width)
+    log_path = run_log_path(simulator, arch, vlen, vlane_width, target)
+    params = {"arch": arch, "vlen": vlen, "vlane_width": vlane_width, "target": target}
+    cache_entry = None
+    golden_entry = None
+    outcome = None
+    run_note = ""
+    if use_golden and simulator == "verilator":
+        # The golden trace archive replaces the simulation cache for Verilator,
+        # comparisons read a link to its compressed trace directly
+        golden_trace = tracearchive.linked_trace(sim_trace_dir, target)
+        golden_entry = await asyncio.to_thread(tracearchive.golden_key, params)
+        if golden_entry:
+            archived = await asyncio.to_thread(tracearchive.lookup, golden_entry[0])
+            if archived and await asyncio.to_thread(
+                tracearchive.link, archived[0], golden_trace
+            ):
+                (sim_trace_dir / f"{target}_trace.txt").unlink(missing_ok=True)
+                outcome = archived[1]
+                run_note = " (golden archive)"
+        if outcome is None:
+            # The comparison must read the trace of this simulation
+            golden_trace.unlink(missing_ok=True)
+    elif use_cache:
+        cache_entry = await asyncio.to_thread(
+            simcache.sim_key,
+            simulator,
+            [str(arg) for arg in run_args[1:]],
+            params,
+            run_script_dir,
         )
-    except subprocess.TimeoutExpired:
-        error(fname, f"{error_msg_header} Process timed out")
-        return False
+        if cache_entry:
+            outcome = await asyncio.to_thread(
+                simcache.restore, simulator, cache_entry[0], sim_trace_dir, target
+            )
+            run_note = " (cached)" if outcome else ""
+
+    if outcome is None:
+        # Longest expected simulations start first
+        job_key = (simulator, arch, vlen, vlane_width, target)
+        estimate = history.estimate(job_key) if history else 0.0
+        timeout = history.timeout(job_key) if history else config.TIMEOUT
+        # Reserve the recorded peak memory of the job where there is one
+        peak_rss_mb = history.peak_rss_mb(job_key) if history else None
+        mem_mb = (
+            int(peak_rss_mb * config.SIM_MEM_MARGIN)
+            if peak_rss_mb
+            else config.SIM_MEM_MB[simulator]
+        )
+        async with budget.reserve(config.SIM_THREADS[simulator], mem_mb, estimate):
+            start_time = time.monotonic()
+            info(
+                fname,
+                f"\tRunning {target:{target_sw_width}} on {full_arch_string} (timeout {timeout:.0f}s)",
+            )
+            # The run is killed as soon as a fail marker is printed
+            # Key of the task graph task, ETISS runs are shared by all lane widths
+            task_key = (
+                ("run", simulator, arch, vlen, target)
+                if simulator == "etiss"
+                else ("run", simulator, *job_key[1:])
+            )
+            try:
+                with timeline.span(
+                    f"{simulator} {target} on {full_arch_string}", "run_test", task_key
+                ) as run_span:
+                    _, stdout, stderr, found, usage = await asyncio.wait_for(
+                        stream_process(
+                            run_args,
+                            log_path,
+                            SIM_MARKERS[simulator],
+                            SIM_STOP_MARKERS[simulator],
+                            config.OUTPUT_TAIL_LINES,
+                            config.MONITOR_INTERVAL_S,
+                        ),
+                        timeout,
+                    )
+                    if usage:
+                        run_span["cpu_s"] = usage["user_s"] + usage["sys_s"]
+            except TimeoutError:
+                error(
+                    fname,
+                    f"{error_msg_header} Process timed out after {timeout:.0f}s (log: {log_path})",
+                )
+                if history:
+                    # The next run of the job gets a longer timeout
+                    history.record(job_key, timeout, timed_out=True)
+                return False
+
+        # Only the tail of the output, the whole output is in the log
+        if config.PRINT_TEST_STDOUT and stdout:
+            print(stdout)
+
+        # stdout_lines = proc.stdout.split("\n")
+        # time: str = ""
+        # for line in stdout_lines:
+        #     if "user" in line:
+        #         time = line.strip().split(" ")[1]
+        #         with open(RUNTIME_DIR / target, "a", encoding="utf-8") as runtime_file:
+        #             runtime_file.write(f"{vlen} & {vlane_width} & {time}\n")
+        #         break
+
+        # Check for error, with STOP_ON_ERROR the task graph cancels all other
+        # tasks once this one failed
+        if stderr:
+            stderr_out = f"\n{stderr}" if config.PRINT_STDERR else ""
+            error(
+                fname,
+                f"{error_msg_header} Process returned stderr (log: {log_path}){stderr_out}",
+            )
+            return False
 
-    if config.PRINT_TEST_STDOUT and proc.stdout:
-        print(proc.stdout)
-
-    # stdout_lines = proc.stdout.split("\n")
-    # time: str = ""
-    # for line in stdout_lines:
-    #     if "user" in line:
-    #         time = line.strip().split(" ")[1]
-    #         with open(RUNTIME_DIR / target, "a", encoding="utf-8") as runtime_file:
-    #             runtime_file.write(f"{vlen} & {vlane_width} & {time}\n")
-    #         break
-
-    # Check for error
-    # TODO: Be able to abort all processes on error?
-    if proc.stderr:
-        stderr_out = f"\n{proc.stderr}" if config.PRINT_STDERR else ""
-        error(fname, f"{error_msg_header} Process returned stderr{stderr_out}")
-        if config.STOP_ON_ERROR:
-            exit(1)
-        return False
+        # Only outcomes reported by the program or simulator are cached, errors
+        # and timeouts may be transient
+        fail_reason, success_found = check_output(simulator, found)
+        if history and not fail_reason:
+            # Failed runs may have been stopped early
+            history.record(job_key, time.monotonic() - start_time, usage)
+        if usage:
+            run_note = (
+                f" ({time.monotonic() - start_time:.1f}s, "
+                f"{usage['peak_rss_mb']:.0f} MB peak RSS, "
+                f"{usage['user_s'] + usage['sys_s']:.1f}s CPU)"
+            )
+        outcome = {"fail_reason": fail_reason, "success_found": success_found}
+        if cache_entry:
+            await asyncio.to_thread(
+                simcache.store,
+                simulator,
+                *cache_entry,
+                outcome,
+                sim_trace_dir,
+                target,
+            )
+        if golden_entry and not fail_reason:
+            await asyncio.to_thread(
+                tracearchive.add,
+                *golden_entry,
+                sim_trace_dir / f"{target}_trace.txt",
+                outcome,
+            )
 
     # Check output for fail/success
-    success_found = False
-    if simulator == "etiss":
-        if ETISS_FAIL_STRING in proc.stdout:
-            error(fname, f"{error_msg_header}: Fail (By program report)")
-            return False
-        if ETISS_ERROR_STRING in proc.stdout:
-            error(fname, f"{error_msg_header}: Fail (ETISS error)")
-            return False
-        if ETISS_SUCCESS_STRING in proc.stdout:
-            success_found = True
-    else:
-        if VERILATOR_FAIL_STRING in proc.stdout:
-            error(fname, f"{error_msg_header}: Fail (Output Mismatch)")
-            return False
-        if VERILATOR_INTERRUPT_STRING in proc.stdout:
-            error(fname, f"{error_msg_header}: Fail (Interrupt Called)")
-            return False
-        if VERILATOR_SUCCESS_STRING in proc.stdout:
-            success_found = True
+    if outcome["fail_reason"]:
+        error(fname, f"{error_msg_header}: Fail ({outcome['fail_reason']}){run_note}")
+        return False
 
     success(
         fname,
         (
             f"\tSuccess {target:{target_sw_width}} on {full_arch_string}"
-            + (": Success string found" if success_found else "")
+            + (": Success string found" if outcome["success_found"] else "")
+            + run_note
         ),
     )
     return True
 
 
-def run_all(
+def history_key(test_config: dict, key: tuple) -> tuple | None:
+    """JobHistory key of a simulation task, None for other tasks."""
+    if key[0] != "run":
+        return None
+    if key[1] == "etiss":
+        _, simulator, arch, vlen, target = key
+        etiss_width = etiss_vlane_width(vlen, test_config[arch]["vlane_widths"])
+        return (simulator, arch, vlen, etiss_width, target)
+    return key[1:]
+
+
+def add_runs(
+    graph: TaskGraph,
     test_config: dict,
+    configs: list[Config],
     run_etiss: bool,
     run_verilator: bool,
-    n_processes: int = 1,
-) -> bool:
-    fname = "run_all"
-    info(fname, f"Running tests for ETISS: {run_etiss}, Verilator: {run_verilator}")
-    archs = test_config.keys()
-    arglist = []
+    budget: ResourceBudget,
+    use_cache: dict[str, bool],
+    use_golden: bool,
+    history: JobHistory,
+) -> None:
+    if run_etiss:
+        for arch, vlen, target in etiss_configs(configs):
+            # Lane width of the shared run does not depend on the selected configs
+            etiss_width = etiss_vlane_width(vlen, test_config[arch]["vlane_widths"])
+            log_path = run_log_path("etiss", arch, vlen, etiss_width, target)
+            graph.add(
+                ("run", "etiss", arch, vlen, target),
+                f"etiss {target} on {arch}_zvl{vlen}b (log: {log_path})",
+                partial(
+                    run_test,
+                    arch,
+                    vlen,
+                    etiss_width,
+                    target,
+                    "etiss",
+                    budget,
+                    use_cache["etiss"],
+                    history=history,
+                ),
+                [graph.get(("build_test", arch, vlen))],
+                history.estimate(("etiss", arch, vlen, etiss_width, target)),
+            )
+    if run_verilator:
+        for arch, vlen, vlane_width, target in configs:
+            log_path = run_log_path("verilator", arch, vlen, vlane_width, target)
+            graph.add(
+                ("run", "verilator", arch, vlen, vlane_width, target),
+                f"verilator {target} on {arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width} (log: {log_path})",
+                partial(
+                    run_test,
+                    arch,
+                    vlen,
+                    vlane_width,
+                    target,
+                    "verilator",
+                    budget,
+                    use_cache["verilator"],
+                    use_golden,
+                    history,
+                ),
+                [
+                    graph.get(("build_test", arch, vlen)),
+                    graph.get(("build_rtl", arch, vlen, vlane_width)),
+                ],
+                history.estimate(("verilator", arch, vlen, vlane_width, target)),
+            )
 
-    for arch in archs:
-        if test_config[arch]["skip"]:
-            continue
-        vlens = test_config[arch]["vlens"]
-        targets = test_config[arch]["targets"]
-        vlane_widths = test_config[arch]["vlane_widths"]
-        for vlen in vlens:
-            for vlane_width in vlane_widths:
-                if vlane_width not in VLANE_WIDTH_COMBINATIONS[vlen]:
-                    # Skip illegal VLEN / VLANE_W combinations
-                    continue
-                for target in targets:
-                    if run_etiss:
-                        arglist.append((arch, vlen, vlane_width, target, "etiss"))
-                    if run_verilator:
-                        arglist.append((arch, vlen, vlane_width, target, "verilator"))
-
-    if n_processes > mp.cpu_count():
-        info(fname, f"# of processes higher than nproc, reducing to {mp.cpu_count()}")
-    with mp.Pool(processes=n_processes) as pool:
-        res = pool.starmap(run_test, arglist)
-
-    return False if False in res else True
-
-
-def compare_all(argslist: list[tuple[str, int, int, str]], gen_table: bool) -> bool:
-    ok = True
-    results = []
-    fname = "compare_all"
 
-    for args in argslist:
-        arch, vlen, vlane_width, target = args
-        # Returns CPI ETISS, CPI Verilator, CPI Error in %, Abs sum of differences, OK
-        info(
-            fname,
-            f"Compare {target} on {arch} with VLEN {vlen} and VLANE_WIDTH {vlane_width}",
-        )
-        cpi_e, cpi_v, cpi_error, abs_sum_diffs, n_instructions, ok_run = compare_fast(
-            arch,
-            vlen,
-            vlane_width,
-            target,
-            keep_traces=False,
-            print_stages=True,
-            write_match=True,
-        )
-        if ok_run:
-            success(
+async def compare(
+    args: tuple[str, int, int, str],
+    etiss_width: int,
+    compare_options: dict,
+    budget: ResourceBudget,
+    executor: Executor,
+    results: dict,
+    etiss_refs: dict[tuple[str, int, str], int],
+    use_golden: bool = False,
+    profile_options: dict | None = None,
+) -> bool:
+    fname = "compare"
+    arch, vlen, vlane_width, target = args
+    etiss_key = (arch, vlen, target)
+    # Linked by the run if it was restored from the golden archive
+    golden_trace = tracearchive.linked_trace(
+        trace_dir("verilator", arch, vlen, vlane_width), target
+    )
+    if not use_golden or not golden_trace.is_file():
+        golden_trace = None
+    try:
+        # The comparison is CPU bound, run it in a worker process
+        async with budget.reserve(1):
+            info(
                 fname,
-                f"Comparison results: CPI ETISS {cpi_e:.4f} | CPI RTL {cpi_v:.4f} | Error {cpi_error:.4f}% | ASD {abs_sum_diffs} | ADI {abs_sum_diffs / n_instructions:.4f}",
+                f"Compare {target} on {arch} with VLEN {vlen} and VLANE_WIDTH {vlane_width}",
             )
-        else:
-            error(fname, "Comparison failed")
-        if "_" in target:
-            target = target.replace("_", "\\_")
-        if "_" in arch:
-            arch = arch.replace("_", "\\_")
-        avg_diff_per_instruction = abs_sum_diffs / n_instructions
-        results.append(
-            (
-                target,
+            compare_call = partial(
+                compare_fast,
                 arch,
                 vlen,
                 vlane_width,
-                cpi_e,
-                cpi_v,
-                cpi_error,
-                avg_diff_per_instruction,
-                n_instructions,
-            )
-        )
-        ok &= ok_run
-
-    if gen_table:
-        info(fname, "Generate table")
-        with open(TABLE_DIR / "table.tex", "w", encoding="utf-8") as table_file:
-            table_file.write("\\begin{center}\n")
-            table_file.write("\\begin{tabular}{ c c c c c c c }\n")
-            table_file.write(
-                "Target & VLEN & VLANE\\_WIDTH & CPI ETISS & CPI Verilator & Error & ADI & # Instrs."
+                target,
+                **compare_options,
+                etiss_vlane_width=etiss_width,
+                keep_etiss_traces=True,
+                golden_trace=golden_trace,
             )
-            for result in results:
-                (
-                    r_target,
-                    r_arch,
-                    r_vlen,
-                    r_vlane_width,
-                    r_cpi_e,
-                    r_cpi_v,
-                    r_error,
-                    r_avg_diff_per_inst,
-                    r_n_instructrions,
-                ) = result
-                table_file.write(
-                    f" \\\\\n{r_target} & {r_vlen} & {r_vlane_width} & {r_cpi_e:.4f} & {r_cpi_v:.4f} & {r_error:.4f} \\% & {r_avg_diff_per_inst:.4f} & {r_n_instructrions}"
+            if profile_options and any(profile_options.values()):
+                compare_call = partial(
+                    profiler.profile_call,
+                    compare_call,
+                    f"compare_{target}_{arch}_zvl{vlen}b_vlane{vlane_width}",
+                    **profile_options,
                 )
-            table_file.write("\n\\end{tabular}\n\\end{center}\n")
-
-    return ok
+            with timeline.span(
+                f"compare {target} on {arch}_zvl{vlen}b vlane{vlane_width}",
+                "compare_fast",
+                ("compare", *args),
+            ) as compare_span:
+                result, cpu_s = await asyncio.get_running_loop().run_in_executor(
+                    executor, partial(timeline.call_with_cpu_time, compare_call)
+                )
+                compare_span["cpu_s"] = cpu_s
+    finally:
+        # The shared ETISS trace is deleted after its last comparison
+        etiss_refs[etiss_key] -= 1
+        if etiss_refs[etiss_key] == 0 and not compare_options["keep_traces"]:
+            delete_etiss_traces(trace_dir("etiss", arch, vlen, etiss_width), target)
+
+    # Returns CPI ETISS, CPI Verilator, CPI Error in %, Abs sum of differences, OK,
+    # per-class breakdown
+    cpi_e, cpi_v, cpi_error, abs_sum_diffs, n_instructions, ok_run, _ = result
+    if ok_run:
+        success(
+            fname,
+            f"{target} on {arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width}: CPI ETISS {cpi_e:.4f} | CPI RTL {cpi_v:.4f} | Error {cpi_error:.4f}% | ASD {abs_sum_diffs} | ADI {abs_sum_diffs / n_instructions:.4f}",
+        )
+    else:
+        error(
+            fname,
+            f"{target} on {arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width}: Comparison failed",
+        )
+    results[args] = result
+    return ok_run
 
 
-def gen_argslist(test_config: dict) -> list[tuple[str, int, int, str]]:
-    archs = test_config.keys()
-    argslist: list[tuple[str, int, int, str]] = []
-    for arch in archs:
-        if test_config[arch]["skip"]:
+def add_comparisons(
+    graph: TaskGraph,
+    test_config: dict,
+    argslist: list[Config],
+    compare_options: dict,
+    budget: ResourceBudget,
+    executor: Executor,
+    results: dict,
+    use_golden: bool,
+    finished: set[tuple] | None = None,
+    profile_options: dict | None = None,
+) -> None:
+    # Number of comparisons reading each shared ETISS trace, comparisons that
+    # finished in an earlier run do not read it again
+    etiss_refs: dict[tuple[str, int, str], int] = {}
+    for arch, vlen, vlane_width, target in argslist:
+        if finished and ("compare", arch, vlen, vlane_width, target) in finished:
             continue
-        vlens = test_config[arch]["vlens"]
-        targets = test_config[arch]["targets"]
-        vlane_widths = test_config[arch]["vlane_widths"]
-        for vlen in vlens:
-            for vlane_width in vlane_widths:
-                if vlane_width not in VLANE_WIDTH_COMBINATIONS[vlen]:
-                    # Skip illegal VLEN / VLANE_W combinations
-                    continue
-                for target in targets:
-                    argslist.append((arch, vlen, vlane_width, target))
+        etiss_refs[(arch, vlen, target)] = etiss_refs.get((arch, vlen, target), 0) + 1
 
-    return argslist
+    for args in argslist:
+        arch, vlen, vlane_width, target = args
+        etiss_width = etiss_vlane_width(vlen, test_config[arch]["vlane_widths"])
+        graph.add(
+            ("compare", *args),
+            f"compare {target} on {arch}_zvl{vlen}b, VLANE_WIDTH {vlane_width}",
+            partial(
+                compare,
+                args,
+                etiss_width,
+                compare_options,
+                budget,
+                executor,
+                results,
+                etiss_refs,
+                use_golden,
+                profile_options,
+            ),
+            [
+                graph.get(("run", "etiss", arch, vlen, target)),
+                graph.get(("run", "verilator", *args)),
+            ],
+        )
 
 
-def test_sequential(test_config: dict):
+def delete_compared_etiss_traces(
+    graph: TaskGraph, test_config: dict, configs: list[Config]
+) -> None:
+    """Deletes the shared ETISS traces whose comparisons all finished.
+
+    A comparison that was skipped or cancelled never releases its reference on
+    the shared trace, and workers only delete a shared trace if they ran all of
+    its comparisons themselves.
+    """
+    for arch, vlen, target in etiss_configs(configs):
+        compares = [
+            graph.get(("compare", arch, vlen, vlane_width, target))
+            for config_arch, config_vlen, vlane_width, config_target in configs
+            if (config_arch, config_vlen, config_target) == (arch, vlen, target)
+        ]
+        if all(task.state not in ("pending", "running") for task in compares):
+            etiss_width = etiss_vlane_width(vlen, test_config[arch]["vlane_widths"])
+            delete_etiss_traces(trace_dir("etiss", arch, vlen, etiss_width), target)
+
+
+def runs_missing_traces(
+    finished: set[tuple], test_config: dict, configs: list[Config]
+) -> set[tuple]:
+    """Finished runs whose trace a comparison that did not finish still needs.
+
+    A shared ETISS trace is deleted after its last comparison ran, even if
+    that comparison failed, so resuming it needs the run again.
+    """
+    missing = set()
+    for arch, vlen, vlane_width, target in configs:
+        if ("compare", arch, vlen, vlane_width, target) in finished:
+            continue
+        etiss_width = etiss_vlane_width(vlen, test_config[arch]["vlane_widths"])
+        run_trace_dirs = {
+            ("run", "etiss", arch, vlen, target): trace_dir(
+                "etiss", arch, vlen, etiss_width
+            ),
+            ("run", "verilator", arch, vlen, vlane_width, target): trace_dir(
+                "verilator", arch, vlen, vlane_width
+            ),
+        }
+        for key, run_trace_dir in run_trace_dirs.items():
+            traces = [
+                run_trace_dir / f"{target}_trace.txt",
+                tracearchive.linked_trace(run_trace_dir, target),
+            ]
+            if key in finished and not any(trace.is_file() for trace in traces):
+                missing.add(key)
+    return missing
+
+
+def test_sequential(
+    configs: list[Config],
+    db: ResultsDB,
+    session_id: int,
+    history: JobHistory,
+    cores: int | None = None,
+):
     fname = "test_sequential"
-    arglist = gen_argslist(test_config)
     ok = True
+
+    async def run_pair(args: tuple[str, int, int, str]) -> list[bool]:
+        # The budget's condition is bound to the event loop of this pair
+        budget = ResourceBudget(cores, config.MAX_MEM_MB)
+        return await asyncio.gather(
+            run_test(*args, "etiss", budget, history=history),
+            run_test(*args, "verilator", budget, history=history),
+        )
+
     with open(TABLE_DIR / "table_seq.txt", "w", encoding="utf-8") as seq_table:
-        for args in arglist:
+        for args in configs:
             arch, vlen, vlane_width, target = args
-            pair = [
-                [arch, vlen, vlane_width, target, "etiss"],
-                [arch, vlen, vlane_width, target, "verilator"],
-            ]
-            with mp.Pool(processes=2) as pool:
-                res = pool.starmap(run_test, pair)
-                ok = False if False in res else True
+            start_time = time.monotonic()
+            res = asyncio.run(run_pair(args))
+            ok = False if False in res else True
+            run_time = time.monotonic() - start_time
+            db.add_run(session_id, "etiss", arch, vlen, None, target, res[0], run_time)
+            db.add_run(
+                session_id,
+                "verilator",
+                arch,
+                vlen,
+                vlane_width,
+                target,
+                res[1],
+                run_time,
+            )
 
             info(fname, f"Compare pair {arch}, {vlen}, {vlane_width}, {target}")
-            cpi_e, cpi_v, cpi_error, abs_sum_diffs, n_instructions, ok_run = (
-                compare_fast(
+            start_time = time.monotonic()
+            with timeline.span(
+                f"compare {target} on {arch}_zvl{vlen}b vlane{vlane_width}",
+                "compare_fast",
+            ):
+                result = compare_fast(
                     arch,
                     vlen,
                     vlane_width,
@@ -436,7 +918,11 @@ def test_sequential(test_config: dict):
                     print_stages=False,
                     write_match=False,
                 )
-            )
+            db.add_comparison(session_id, args, result, time.monotonic() - start_time)
+            cpi_e, cpi_v, cpi_error, abs_sum_diffs, n_instructions, ok_run, _ = result
+            if not ok_run:
+                error(fname, f"{target} on {arch}_zvl{vlen}b: Comparison failed")
+                continue
             avg_diff_per_instr = abs_sum_diffs / n_instructions
             info(
                 fname,
@@ -447,6 +933,21 @@ def test_sequential(test_config: dict):
             )
 
 
+def write_timing_report(run_timeline: timeline.Timeline, graph: TaskGraph) -> None:
+    # Called after the executor processes are joined, their CPU time is counted
+    timeline.print_summary(
+        run_timeline.events,
+        graph.critical_path(timeline.task_durations(run_timeline.events)),
+        timeline.cpu_time(),
+    )
+    timeline.write_chrome_trace(run_timeline.events)
+    run_timeline.close()
+    info(
+        "TestMatrix",
+        f"Event log: {timeline.EVENT_LOG_PATH}, trace: {timeline.TRACE_PATH}",
+    )
+
+
 def main() -> None:
     fname = "TestMatrix"
     parser = argparse.ArgumentParser(
@@ -459,10 +960,36 @@ def main() -> None:
     parser.add_argument("-t", "--build_tests", action="store_true")
     parser.add_argument("-gt", "--generate_table", action="store_true")
     parser.add_argument("-cmp", "--compare", action="store_true")
-    # parser.add_argument("-j") # TODO: specify number of processes
+    # Ranked per-PC / per-function report of cycle mismatches
+    parser.add_argument("--hotspots", action="store_true")
+    # Take ETISS cycles from the stage where each instruction class retires
+    parser.add_argument(
+        "--class_timing",
+        action="store_true",
+        help="Time LSU / VWXUNARY0 instructions at SLOW_TIMING_STAGE instead of "
+        "EX (stages per class in timingconfig.py)",
+    )
+    # Columnar match store (query with matchstore.py) or one text line per instruction
+    parser.add_argument(
+        "--match_format", type=str, choices=["store", "text"], default="store"
+    )
+    # Cores shared by all builds, simulations and comparisons
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of cores to use (default: config.MAX_CORES or all cores)",
+    )
     # Clean RTL does nothing ATM
     parser.add_argument("-cr", "--clean_rtl", action="store_true")
     parser.add_argument("-ct", "--clean_tests", action="store_true")
+    # Always build, neither restore nor store models and test programs
+    parser.add_argument("--no_build_cache", action="store_true")
+    # Always simulate, neither restore nor store traces and outcomes
+    parser.add_argument("--no_sim_cache", "--no-sim-cache", action="store_true")
+    # Always simulate Verilator and compare against its plain trace
+    parser.add_argument("--no_golden_archive", action="store_true")
     parser.add_argument("-co", "--clean_output", action="store_true")
 
     mutex_run_group = parser.add_mutually_exclusive_group(required=False)
@@ -477,17 +1004,61 @@ def main() -> None:
     parser.add_argument("--compiler", type=str, required=False)
     parser.add_argument("--trace", action="store_true")
 
-    mutex_target_group = parser.add_mutually_exclusive_group(required=True)
+    # One of them is required, except for workers
+    mutex_target_group = parser.add_mutually_exclusive_group(required=False)
     # CMake custom build target
     mutex_target_group.add_argument("--ctarget", type=str)
     # Actual program
     mutex_target_group.add_argument("--target", type=str)
 
+    # Filters of the configuration space, all phases only handle the selected
+    # (arch, VLEN, VLANE_WIDTH, target) configurations
+    parser.add_argument("--arch", type=parse_list, help="e.g. rv32im_zve32x")
+    parser.add_argument("--vlen", type=parse_int_list, help="e.g. 256,1024")
+    parser.add_argument("--vlane", type=parse_int_list, help="e.g. 64")
+    parser.add_argument(
+        "--target_glob", "--target-glob", type=str, help="e.g. 'load_*_store'"
+    )
+    # Failed runs and comparisons of the last results database session
+    parser.add_argument(
+        "--only_failed_from_last_run",
+        "--only-failed-from-last-run",
+        action="store_true",
+    )
+
     parser.add_argument("--keep_traces", action="store_true")
     parser.add_argument("--seq", action="store_true")
+    # Profile every comparison with cProfile / tracemalloc, see profiler.py
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile_mem", "--profile-mem", action="store_true")
+    # Skip tasks the journal of the previous run records as done
+    parser.add_argument("--resume", action="store_true")
+    # Serve all tasks to workers instead of running them, see distributed.py
+    parser.add_argument(
+        "--coordinator",
+        type=int,
+        nargs="?",
+        const=config.DISTRIBUTED_PORT,
+        metavar="PORT",
+    )
+    # Interface the coordinator listens on, "" for all
+    parser.add_argument("--bind", type=str, default=config.DISTRIBUTED_HOST)
+    # Run tasks of the coordinator at HOST:PORT, with its arguments
+    parser.add_argument("--worker", type=str, metavar="HOST:PORT")
 
     args = parser.parse_args()
 
+    manager = None
+    if args.worker:
+        manager = distributed.connect(args.worker)
+        info(fname, f"Connected to coordinator {args.worker}")
+        jobs = args.jobs
+        args = parser.parse_args(manager.get_session().argv())
+        args.coordinator = None
+        args.jobs = jobs
+    elif not args.ctarget and not args.target:
+        parser.error("one of the arguments --ctarget --target is required")
+
     run_etiss = False
     run_verilator = False
 
@@ -522,10 +1093,79 @@ def main() -> None:
             arch["targets"] = [args.target]
         build_target = args.target
 
-    argslist = gen_argslist(test_config)
-
+    db = None if manager else ResultsDB()
+    if manager:
+        # The coordinator's selection, the filters could select others by now
+        configs = manager.get_session().configs()
+    else:
+        only = None
+        if args.only_failed_from_last_run:
+            last_session = db.last_session()
+            only = db.failed_configs(last_session) if last_session else set()
+            info(fname, f"{len(only)} failed configurations in session {last_session}")
+        configs = enumerate_configs(
+            test_config, args.arch, args.vlen, args.vlane, args.target_glob, only
+        )
+    if not configs:
+        warn(fname, "No configuration matches the filters")
+    info(fname, f"Selected {len(configs)} configurations")
+
+    # Every phase adds its tasks to one graph: a simulation starts as soon as
+    # its model and binary are built, a comparison as soon as both simulations
+    # are done
+    budget = ResourceBudget(args.jobs or config.MAX_CORES, config.MAX_MEM_MB)
+    info(fname, f"Using {budget.cores} cores and {budget.mem_mb} MB")
+    graph = TaskGraph(budget.cores)
+    history = JobHistory()
+    results = {}
+    finished = set()
+    run_timeline = None
+    if not manager:
+        journal = Journal(resume=args.resume)
+        finished = journal.finished()
+        if args.compare:
+            rerun = runs_missing_traces(finished, test_config, configs)
+            if rerun:
+                info(
+                    fname,
+                    f"Running {len(rerun)} finished runs again, their traces are gone",
+                )
+                finished -= rerun
+        # A resumed run continues the session of the interrupted one, its
+        # tables include the comparisons that finished before the interruption
+        session_id = db.last_session() if args.resume else None
+        if session_id is None:
+            session_id = db.start_session(" ".join(sys.argv))
+        run_timeline = timeline.start(resume=args.resume)
+
+    # A simulator is only cached if its built model is part of the key
+    use_sim_cache = {
+        simulator: not args.no_sim_cache and bool(config.SIM_MODEL_DIRS[simulator])
+        for simulator in ["etiss", "verilator"]
+    }
+    if run_etiss and not args.no_sim_cache and not use_sim_cache["etiss"]:
+        info(
+            fname, "Not caching ETISS runs, config.SIM_MODEL_DIRS lists no ETISS model"
+        )
+    use_golden = not args.no_golden_archive
+    # The build and simulation caches and the golden archive key on the built
+    # RTL models, they are not used for models config.RTL_ARTIFACT_DIRS misses
+    check_models = not args.no_build_cache or (
+        run_verilator and (use_sim_cache["verilator"] or use_golden)
+    )
     if args.build_rtl:
-        build_rtl_list(test_config, optargs_rtl)
+        add_rtl_builds(
+            graph,
+            configs,
+            optargs_rtl,
+            budget,
+            not args.no_build_cache,
+            check_models,
+        )
+    elif check_models and run_verilator and not args.seq:
+        if not check_rtl_models(rtl_configs(configs), "before the simulations"):
+            use_sim_cache["verilator"] = False
+            use_golden = False
 
     if args.build_tests:
         build_type = BuildType.release
@@ -536,24 +1176,161 @@ def main() -> None:
             build_type = BuildType.reldeb
         if args.debug:
             build_type = BuildType.debug
-        build_all_tests(
-            test_config, BuildType(build_type), compiler, build_target, optargs_build
+        add_test_builds(
+            graph,
+            test_config,
+            configs,
+            BuildType(build_type),
+            compiler,
+            build_target,
+            optargs_build,
+            budget,
+            not args.no_build_cache,
         )
 
-    if args.seq:
-        test_sequential(test_config)
-    else:
-        if run_etiss or run_verilator:
-            if run_all(test_config, run_etiss, run_verilator, 31):
-                success(fname, "All tests passed")
-            else:
-                warn(fname, "Warning: Failing tests")
+    compare_options = {
+        "keep_traces": args.keep_traces,
+        "print_stages": True,
+        "write_match": True,
+        "write_hotspots": args.hotspots,
+        "class_timing": args.class_timing,
+        "match_format": args.match_format,
+    }
 
-        if args.compare:
-            if compare_all(argslist, args.generate_table):
-                success(fname, "All comparisons correct")
-            else:
-                warn(fname, "Warning: comparison errors")
+    try:
+        with ProcessPoolExecutor(max_workers=budget.cores) as executor:
+            if not args.seq:
+                if run_etiss or run_verilator:
+                    add_runs(
+                        graph,
+                        test_config,
+                        configs,
+                        run_etiss,
+                        run_verilator,
+                        budget,
+                        use_sim_cache,
+                        use_golden,
+                        history,
+                    )
+                if args.compare:
+                    add_comparisons(
+                        graph,
+                        test_config,
+                        configs,
+                        compare_options,
+                        budget,
+                        executor,
+                        results,
+                        use_golden,
+                        finished,
+                        {"profile": args.profile, "profile_mem": args.profile_mem},
+                    )
+
+            if manager:
+                try:
+                    asyncio.run(distributed.work(manager, graph, results, budget.cores))
+                finally:
+                    history.save()
+                return
+
+            if graph.tasks:
+                coordinator = None
+                if args.coordinator:
+                    coordinator = distributed.Coordinator(
+                        args.bind, args.coordinator, sys.argv[1:], configs
+                    )
+                    for task in graph.tasks.values():
+                        job_key = history_key(test_config, task.key)
+                        task.run = partial(
+                            coordinator.run,
+                            task.key,
+                            results,
+                            task.estimate,
+                            history.timeout(job_key) if job_key else None,
+                        )
+                if args.resume:
+                    info(
+                        fname,
+                        f"Resuming, {graph.resume(finished)} of {len(graph.tasks)} tasks already done",
+                    )
+
+                def add_to_db(task, result) -> None:
+                    phase, *params = task.key
+                    if phase == "run":
+                        simulator, arch, vlen, *_, target = params
+                        vlane_width = params[3] if simulator == "verilator" else None
+                        db.add_run(
+                            session_id,
+                            simulator,
+                            arch,
+                            vlen,
+                            vlane_width,
+                            target,
+                            task.state == "done",
+                            task.elapsed(),
+                        )
+                    elif phase == "compare":
+                        db.add_comparison(
+                            session_id, tuple(params), result, task.elapsed()
+                        )
+
+                def record(task) -> None:
+                    phase, *params = task.key
+                    result = results.get(tuple(params)) if phase == "compare" else None
+                    journal.record(task.key, task.state, task.elapsed(), result)
+                    add_to_db(task, result)
+
+                try:
+                    graph_ok = graph.run(config.STOP_ON_ERROR, on_finish=record)
+                finally:
+                    history.save()
+                    journal.close()
+                    if coordinator:
+                        coordinator.finish()
+                # Runs and comparisons skipped after a failed dependency or cancelled
+                # by STOP_ON_ERROR are failed for --only-failed-from-last-run
+                for task in graph.tasks.values():
+                    if task.state in ("pending", "skipped"):
+                        add_to_db(task, None)
+                if args.compare and not args.keep_traces:
+                    delete_compared_etiss_traces(graph, test_config, configs)
+                if graph_ok:
+                    success(fname, "All tasks successful")
+                else:
+                    for phase in ["build_rtl", "build_test", "run", "compare"]:
+                        tasks = [
+                            task
+                            for task in graph.tasks.values()
+                            if task.key[0] == phase
+                        ]
+                        not_done = [task for task in tasks if task.state != "done"]
+                        for task in not_done:
+                            if task.state == "failed":
+                                error(fname, f"Failed: {task.label}")
+                            else:
+                                warn(fname, f"Not run: {task.label}")
+                        if not_done:
+                            warn(
+                                fname,
+                                f"Warning: {len(not_done)} of {len(tasks)} {phase} tasks not done",
+                            )
+                    if config.STOP_ON_ERROR:
+                        exit(1)
+
+        if args.seq:
+            try:
+                test_sequential(
+                    configs, db, session_id, history, args.jobs or config.MAX_CORES
+                )
+            finally:
+                history.save()
+        elif args.compare and args.generate_table:
+            with timeline.span("write_tables", "write_tables"):
+                write_tables(db.table_rows(session_id), TABLE_DIR / "table.tex")
+        db.close()
+    finally:
+        if run_timeline:
+            write_timing_report(run_timeline, graph)
 
     if args.clean_output:
         clean_script_path = pathlib.Path(__file__).parent / "clean-output.sh"
@@ -0,0 +1,262 @@
+import asyncio
+import codecs
+import os
+import pathlib
+import re
+import signal
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from procmonitor import ProcessTreeMonitor
+
+MEMINFO_PATH = pathlib.Path("/proc/meminfo")
+STREAM_CHUNK_SIZE = 1 << 16
+# Seconds between SIGTERM and SIGKILL when a cancelled process is stopped
+KILL_GRACE_S = 5
+
+
+def available_memory_mb() -> int:
+    """Returns MemAvailable from /proc/meminfo, or 0 if it can not be read."""
+    try:
+        with open(MEMINFO_PATH, "r", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+
+class ResourceBudget:
+    """Cores and memory shared by jobs that run concurrently.
+
+    A job reserves the cores and memory it is expected to use at its peak and
+    waits until both are free. Requests larger than the whole budget are
+    clamped, so such a job runs alone instead of never.
+
+    Among the waiting jobs that fit into the free resources, the one with the
+    highest priority goes first (ties in arrival order). Smaller jobs may still
+    start while a larger one with higher priority waits for resources.
+    """
+
+    def __init__(self, cores: int | None = None, mem_mb: int | None = None) -> None:
+        self.cores = cores or os.cpu_count() or 1
+        # Without /proc/meminfo, only cores are limited
+        self.mem_mb = mem_mb or available_memory_mb() or 1 << 40
+        self.free_cores = self.cores
+        self.free_mem_mb = self.mem_mb
+        self.condition = asyncio.Condition()
+        # Arrival number: (priority, cores, mem_mb) of every waiting job
+        self.waiting: dict[int, tuple[float, int, int]] = {}
+        self.arrivals = 0
+
+    def clamp(self, cores: int, mem_mb: int) -> tuple[int, int]:
+        return min(max(cores, 1), self.cores), min(max(mem_mb, 0), self.mem_mb)
+
+    def fits(self, cores: int, mem_mb: int) -> bool:
+        return self.free_cores >= cores and self.free_mem_mb >= mem_mb
+
+    def is_next(self, arrival: int) -> bool:
+        priority, cores, mem_mb = self.waiting[arrival]
+        if not self.fits(cores, mem_mb):
+            return False
+        return not any(
+            (other_priority, -other_arrival) > (priority, -arrival)
+            and self.fits(other_cores, other_mem_mb)
+            for other_arrival, (
+                other_priority,
+                other_cores,
+                other_mem_mb,
+            ) in self.waiting.items()
+        )
+
+    async def acquire(self, cores: int, mem_mb: int, priority: float = 0.0) -> None:
+        arrival = self.arrivals
+        self.arrivals += 1
+        self.waiting[arrival] = (priority, cores, mem_mb)
+        try:
+            # Jobs that became ready at the same time register before the first
+            # one is granted
+            await asyncio.sleep(0)
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.is_next(arrival))
+                del self.waiting[arrival]
+                self.free_cores -= cores
+                self.free_mem_mb -= mem_mb
+                # Jobs that yielded to this one may fit now
+                self.condition.notify_all()
+        except asyncio.CancelledError:
+            if self.waiting.pop(arrival, None):
+                async with self.condition:
+                    self.condition.notify_all()
+            raise
+
+    async def release(self, cores: int, mem_mb: int) -> None:
+        async with self.condition:
+            self.free_cores += cores
+            self.free_mem_mb += mem_mb
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(
+        self, cores: int, mem_mb: int = 0, priority: float = 0.0
+    ) -> AsyncIterator[None]:
+        cores, mem_mb = self.clamp(cores, mem_mb)
+        await self.acquire(cores, mem_mb, priority)
+        try:
+            yield
+        finally:
+            await self.release(cores, mem_mb)
+
+
+async def run_process(args: list) -> tuple[int, str, str]:
+    """Runs a process and returns its return code, stdout and stderr.
+
+    The process group is terminated if the calling task is cancelled.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *[str(arg) for arg in args],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        await terminate_process_group(proc)
+        raise
+    return (
+        proc.returncode,
+        stdout.decode("utf-8", errors="replace"),
+        stderr.decode("utf-8", errors="replace"),
+    )
+
+
+def signal_process_group(proc: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def kill_process_group(proc: asyncio.subprocess.Process) -> None:
+    if proc.returncode is None:
+        signal_process_group(proc, signal.SIGKILL)
+
+
+async def terminate_process_group(
+    proc: asyncio.subprocess.Process, grace: float = KILL_GRACE_S
+) -> None:
+    """Sends SIGTERM to the process group of `proc`, SIGKILL after `grace` seconds.
+
+    Every process is started in its own session, so this also stops the
+    simulators and compilers started by the scripts.
+    """
+    if proc.returncode is None:
+        signal_process_group(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), grace)
+        except TimeoutError:
+            pass
+    # Children that ignored SIGTERM or outlived the script
+    signal_process_group(proc, signal.SIGKILL)
+    await proc.wait()
+
+
+async def stream_process(
+    args: list,
+    log_path: pathlib.Path,
+    markers: list[str],
+    stop_markers: list[str],
+    tail_lines: int,
+    monitor_interval: float | None = None,
+) -> tuple[int, str, str, set[str], dict[str, float] | None]:
+    """Runs a process, writing its whole output to `log_path` as it arrives.
+
+    Only the last `tail_lines` lines of stdout and stderr are kept in memory.
+    Returns the return code, both tails, the `markers` found in stdout and, with
+    a `monitor_interval`, the resource usage of the process tree (see
+    procmonitor.py). The process is killed as soon as one of the `stop_markers`
+    appears, or if the calling task is cancelled.
+
+    Markers are regular expressions searched in every complete line of stdout,
+    ^ and $ match at the start and end of a line.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *[str(arg) for arg in args],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # Own process group, so the simulator started by a run script is
+        # killed together with the script
+        start_new_session=True,
+    )
+    stdout_tail: deque[str] = deque(maxlen=tail_lines)
+    stderr_tail: deque[str] = deque(maxlen=tail_lines)
+    found: set[str] = set()
+    patterns = {marker: re.compile(marker, re.MULTILINE) for marker in markers}
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    async def read_stream(
+        stream: asyncio.StreamReader, tail: deque[str], prefix: str, check: bool
+    ) -> None:
+        # Works on whole chunks, verbose simulators print millions of lines
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial_line = ""
+        while chunk := await stream.read(STREAM_CHUNK_SIZE):
+            text = partial_line + decoder.decode(chunk)
+            lines = text.split("\n")
+            partial_line = lines.pop()
+            tail.extend(lines)
+            complete = text[: len(text) - len(partial_line)]
+            if prefix:
+                log_file.writelines(prefix + line + "\n" for line in lines)
+            else:
+                log_file.write(complete)
+            if check:
+                check_markers(complete)
+        if partial_line:
+            tail.append(partial_line)
+            log_file.write(prefix + partial_line + "\n")
+            if check:
+                check_markers(partial_line)
+
+    def check_markers(text: str) -> None:
+        # A marker may be split across chunks, the unfinished line is only
+        # searched once it is complete
+        for marker, pattern in patterns.items():
+            if pattern.search(text):
+                found.add(marker)
+                if marker in stop_markers:
+                    kill_process_group(proc)
+
+    # The process is the leader of its own session
+    monitor = ProcessTreeMonitor(proc.pid) if monitor_interval else None
+    sampler = asyncio.create_task(monitor.run(monitor_interval)) if monitor else None
+
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        log_file.write(" ".join(str(arg) for arg in args) + "\n")
+        try:
+            await asyncio.gather(
+                read_stream(proc.stdout, stdout_tail, "", True),
+                read_stream(proc.stderr, stderr_tail, "[stderr] ", False),
+            )
+            if monitor:
+                # Last sample, the exited process can still be read until waited
+                sampler.cancel()
+                monitor.sample()
+            await proc.wait()
+        except asyncio.CancelledError:
+            await terminate_process_group(proc)
+            raise
+        finally:
+            if sampler:
+                sampler.cancel()
+
+    return (
+        proc.returncode,
+        "\n".join(stdout_tail),
+        "\n".join(stderr_tail),
+        found,
+        monitor.usage() if monitor else None,
+    )
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+from functools import cache
+
+import config
+from buildcache import PROJECT_ROOT_DIR, source_tree_hash
+from util import info, warn
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+CACHE_DIR = (
+    pathlib.Path(config.SIM_CACHE_DIR)
+    if config.SIM_CACHE_DIR
+    else COMPARISON_PRJ_DIR / "comparison" / "cache" / "sim"
+)
+OUTCOME_FILE = "outcome.json"
+TRACES_DIR = "traces"
+
+HASH_CHUNK_SIZE = 1 << 20
+
+# Serializes the eviction of threads storing simulations
+_lock = threading.Lock()
+
+
+def hash_files(paths: list[pathlib.Path]) -> str:
+    """Hash of the names and contents of `paths`."""
+    files_hash = hashlib.sha256()
+    for path in sorted(paths):
+        files_hash.update(str(path).encode("utf-8"))
+        with open(path, "rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                files_hash.update(chunk)
+    return files_hash.hexdigest()
+
+
+@cache
+def model_dir_hash(model_dir: pathlib.Path) -> str:
+    """Hash of all files of a built model, computed once per run of the matrix."""
+    return hash_files([path for path in model_dir.rglob("*") if path.is_file()])
+
+
+def program_hash(simulator: str, params: dict) -> str | None:
+    """Hash of the program files a simulator loads, None if there are none."""
+    fname = "program_hash"
+    program_files = [
+        path
+        for pattern in config.SIM_PROGRAM_FILES[simulator]
+        for path in PROJECT_ROOT_DIR.glob(pattern.format(**params))
+        if path.is_file()
+    ]
+    if not program_files:
+        warn(fname, f"No {simulator} program files of {params['target']}")
+        return None
+    return hash_files(program_files)
+
+
+def model_hash(simulator: str, params: dict) -> list[str] | None:
+    """Hashes of the built simulation model, None if it does not exist."""
+    fname = "model_hash"
+    model_hashes = []
+    for template in config.SIM_MODEL_DIRS[simulator]:
+        model_dir = PROJECT_ROOT_DIR / template.format(**params)
+        if not model_dir.is_dir():
+            warn(fname, f"Model {model_dir} does not exist")
+            return None
+        model_hashes.append(model_dir_hash(model_dir))
+    return model_hashes
+
+
+def sim_key(
+    simulator: str,
+    run_args: list[str],
+    params: dict,
+    src_dir: pathlib.Path,
+) -> tuple[str, dict] | None:
+    """Returns the cache key of a simulation and all inputs it was derived from.
+
+    The key covers the test program files, the simulator (its source tree and,
+    for Verilator, the built model) and the run arguments. None if the program
+    or model files do not exist or the source tree is not a git tree.
+    """
+    fname = "sim_key"
+    program = program_hash(simulator, params)
+    model = model_hash(simulator, params)
+    if program is None or model is None:
+        warn(fname, f"Not caching {simulator} run of {params['target']}")
+        return None
+    tree_hash = source_tree_hash(src_dir)
+    if tree_hash is None:
+        warn(fname, f"{src_dir} is not a git tree, not caching {simulator}")
+        return None
+
+    inputs = {
+        "simulator": simulator,
+        "run_args": run_args,
+        "program": program,
+        "src": tree_hash,
+        "model": model,
+    }
+    key_string = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest(), inputs
+
+
+def trace_files(simulator: str, target: str) -> list[str]:
+    return [name.format(target=target) for name in config.SIM_TRACE_FILES[simulator]]
+
+
+def restore(
+    simulator: str, key: str, trace_dir: pathlib.Path, target: str
+) -> dict | None:
+    """Copies the cached traces of `key` to `trace_dir` and returns the outcome,
+    marking the entry used.
+
+    None on a cache miss, or if another process evicted the entry meanwhile.
+    """
+    entry_dir = CACHE_DIR / simulator / key
+    # The outcome is written last, entries without it are incomplete
+    try:
+        with open(entry_dir / OUTCOME_FILE, "r", encoding="utf-8") as outcome_file:
+            outcome = json.load(outcome_file)
+        os.utime(entry_dir / OUTCOME_FILE)
+
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        for name in trace_files(simulator, target):
+            cached_path = entry_dir / TRACES_DIR / name
+            if cached_path.is_file():
+                # Copy, the comparison deletes its traces
+                shutil.copyfile(cached_path, trace_dir / name)
+    except FileNotFoundError:
+        return None
+    return outcome
+
+
+def store(
+    simulator: str,
+    key: str,
+    inputs: dict,
+    outcome: dict,
+    trace_dir: pathlib.Path,
+    target: str,
+) -> None:
+    """Copies the traces of a finished simulation and its outcome into the cache,
+    then applies the size bound."""
+    entry_dir = CACHE_DIR / simulator / key
+    tmp_dir = CACHE_DIR / simulator / f".{key}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    (tmp_dir / TRACES_DIR).mkdir(parents=True)
+    for name in trace_files(simulator, target):
+        if (trace_dir / name).is_file():
+            shutil.copyfile(trace_dir / name, tmp_dir / TRACES_DIR / name)
+    with open(tmp_dir / OUTCOME_FILE, "w", encoding="utf-8") as outcome_file:
+        json.dump(dict(outcome, inputs=inputs), outcome_file, indent=2)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp_dir.rename(entry_dir)
+    with _lock:
+        evict(config.SIM_CACHE_MAX_MB << 20)
+
+
+def evict(max_bytes: int) -> None:
+    """Removes least recently used entries until the cache fits into `max_bytes`."""
+    fname = "evict"
+    entries = []
+    for outcome_path in CACHE_DIR.glob(f"*/*/{OUTCOME_FILE}"):
+        entry_dir = outcome_path.parent
+        # Entries being stored are hidden
+        if entry_dir.name.startswith("."):
+            continue
+        try:
+            size = sum(
+                path.stat().st_size for path in entry_dir.rglob("*") if path.is_file()
+            )
+            entries.append((outcome_path.stat().st_mtime, entry_dir, size))
+        except FileNotFoundError:
+            # Evicted by another process
+            continue
+    entries.sort()
+
+    total_bytes = sum(size for _, _, size in entries)
+    for _, entry_dir, size in entries:
+        if total_bytes <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_bytes -= size
+        info(
+            fname,
+            f"Evicted {entry_dir.parent.name} simulation {entry_dir.name[:12]} ({size >> 20} MB)",
+        )
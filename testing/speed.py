@@ -5,6 +5,8 @@ import pathlib
 import subprocess
 import multiprocessing as mp
 
+from config import INSTR_COUNT
+
 # TODO: remove WS_PATH stuff
 WS_PATH_ENV_NAME = "WS_PATH"
 WS_PATH_ENV = os.getenv(WS_PATH_ENV_NAME)
@@ -19,27 +21,6 @@ VERILATOR_PRJ_SRC = WS_PATH / "Vicuna2"
 # TODO: does not exit!
 QEMU_PRJ_SRC = WS_PATH / "qemu-testing"
 
-INSTR_COUNT = {
-    "tflm_vww": {
-        128: 71298379,
-        256: 68974858,
-        512: 69103622,
-        1024: 74900400,
-    },
-    "tflm_toy": {
-        128: 587766,
-        256: 414096,
-        512: 325618,
-        1024: 282058,
-    },
-    "tflm_aww": {
-        128: 29016385,
-        256: 27607588,
-        512: 26906876,
-        1024: 26554756,
-    },
-}
-
 N_RUNS = 1
 
 
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from util import error, info, warn
+
+PROGRESS_INTERVAL = 60
+
+
+class Task:
+    """Node of a TaskGraph, runs as soon as all of its dependencies succeeded."""
+
+    def __init__(
+        self,
+        key: tuple,
+        label: str,
+        run: Callable[[], Awaitable[bool]],
+        deps: list["Task"],
+        estimate: float = 0.0,
+    ) -> None:
+        self.key = key
+        self.label = label
+        self.run = run
+        self.deps = deps
+        # Expected wall time in seconds, 0 if unknown
+        self.estimate = estimate
+        # pending, running, done, failed, skipped
+        self.state = "pending"
+        self.start_time = 0.0
+        self.end_time = 0.0
+
+    def elapsed(self) -> float:
+        end_time = self.end_time if self.end_time else time.monotonic()
+        return end_time - self.start_time if self.start_time else 0.0
+
+    def remaining(self) -> float:
+        if self.state == "pending":
+            return self.estimate
+        if self.state == "running":
+            return max(self.estimate - self.elapsed(), 0.0)
+        return 0.0
+
+
+class TaskGraph:
+    """Runs build, simulation and comparison tasks in dependency order.
+
+    Tasks do not limit their own concurrency, every task is started as soon as
+    its dependencies are done and waits on the shared ResourceBudget for the
+    cores and memory it needs.
+    """
+
+    def __init__(self, parallelism: int = 1) -> None:
+        self.tasks: dict[tuple, Task] = {}
+        self.start_time = 0.0
+        # Number of tasks expected to run at once, for the ETA
+        self.parallelism = parallelism
+
+    def add(
+        self,
+        key: tuple,
+        label: str,
+        run: Callable[[], Awaitable[bool]],
+        deps: list[Task | None] | None = None,
+        estimate: float = 0.0,
+    ) -> Task:
+        """Adds a task, dependencies that are None (phase not requested) are ignored."""
+        task = Task(
+            key, label, run, [dep for dep in deps or [] if dep is not None], estimate
+        )
+        self.tasks[key] = task
+        return task
+
+    def resume(self, finished: set[tuple]) -> int:
+        """Marks tasks that finished in an earlier run as done, they are not run again."""
+        resumed = 0
+        for key in finished:
+            if key in self.tasks:
+                self.tasks[key].state = "done"
+                resumed += 1
+        return resumed
+
+    def get(self, key: tuple) -> Task | None:
+        return self.tasks.get(key)
+
+    def count(self, state: str) -> int:
+        return sum(1 for task in self.tasks.values() if task.state == state)
+
+    def critical_path(self, durations: dict[tuple, float]) -> tuple[float, list[tuple]]:
+        """Longest chain of dependent tasks, weighted by `durations` (0 for tasks
+        without one). Returns its length and the keys of its tasks."""
+        # (length, keys) of the longest chain ending in a task. Tasks are
+        # added after their dependencies.
+        longest: dict[tuple, tuple[float, list[tuple]]] = {}
+        for key, task in self.tasks.items():
+            length, keys = max(
+                (longest[dep.key] for dep in task.deps),
+                key=lambda chain: chain[0],
+                default=(0.0, []),
+            )
+            longest[key] = (length + durations.get(key, 0.0), keys + [key])
+        return max(longest.values(), key=lambda chain: chain[0], default=(0.0, []))
+
+    def eta(self) -> float:
+        """Seconds until all tasks with an estimate are done.
+
+        The remaining work is spread over `parallelism` cores, but the matrix
+        can not finish before its longest remaining task.
+        """
+        remaining = [task.remaining() for task in self.tasks.values()]
+        return max(sum(remaining) / self.parallelism, max(remaining, default=0.0))
+
+    def print_progress(self, show_running: bool = False) -> None:
+        finished = sum(
+            1
+            for task in self.tasks.values()
+            if task.state in ("done", "failed", "skipped")
+        )
+        info(
+            "TaskGraph",
+            f"[{finished}/{len(self.tasks)}] {self.count('running')} running, "
+            f"{self.count('failed')} failed, {self.count('skipped')} skipped, "
+            f"{time.monotonic() - self.start_time:.0f}s elapsed, "
+            f"ETA {self.eta():.0f}s",
+        )
+        if show_running:
+            for task in self.tasks.values():
+                if task.state == "running":
+                    info("TaskGraph", f"\t{task.label} ({task.elapsed():.0f}s)")
+
+    async def report_progress(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.print_progress(show_running=True)
+
+    async def execute(
+        self,
+        stop_on_error: bool = False,
+        progress_interval: float = PROGRESS_INTERVAL,
+        on_finish: Callable[[Task], None] | None = None,
+    ) -> bool:
+        """Runs all tasks, `on_finish` is called for every task that ran to
+        completion, done or failed."""
+        self.start_time = time.monotonic()
+        futures: dict[tuple, asyncio.Task] = {}
+
+        async def run_task(task: Task) -> bool:
+            if task.state == "done":
+                # Finished in an earlier run
+                return True
+            try:
+                deps_ok = await asyncio.gather(*[futures[dep.key] for dep in task.deps])
+            except asyncio.CancelledError:
+                # Cancelled before it could start
+                task.state = "skipped"
+                raise
+            if not all(deps_ok):
+                task.state = "skipped"
+                warn("TaskGraph", f"Skipped {task.label}: dependency failed")
+                return False
+
+            task.state = "running"
+            task.start_time = time.monotonic()
+            try:
+                ok = await task.run()
+            except asyncio.CancelledError:
+                task.state = "skipped"
+                raise
+            except Exception as e:
+                error("TaskGraph", f"{task.label} raised {type(e).__name__}: {e}")
+                ok = False
+            task.end_time = time.monotonic()
+            task.state = "done" if ok else "failed"
+            if on_finish:
+                on_finish(task)
+            self.print_progress()
+            return ok
+
+        # All futures exist before the first task awaits its dependencies
+        for key, task in self.tasks.items():
+            futures[key] = asyncio.create_task(run_task(task))
+        progress = asyncio.create_task(self.report_progress(progress_interval))
+
+        pending = set(futures.values())
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            if stop_on_error and any(
+                not future.cancelled() and not future.result() for future in done
+            ):
+                error("TaskGraph", "Task failed, cancelling remaining tasks")
+                for future in pending:
+                    future.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                break
+
+        progress.cancel()
+        self.print_progress()
+        return all(task.state == "done" for task in self.tasks.values())
+
+    def run(
+        self,
+        stop_on_error: bool = False,
+        progress_interval: float = PROGRESS_INTERVAL,
+        on_finish: Callable[[Task], None] | None = None,
+    ) -> bool:
+        return asyncio.run(self.execute(stop_on_error, progress_interval, on_finish))
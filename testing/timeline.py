@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import json
+import pathlib
+import resource
+import time
+from typing import Callable, Iterator
+
+from util import info
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+TIMING_DIR = COMPARISON_PRJ_DIR / "comparison" / "timing"
+EVENT_LOG_PATH = TIMING_DIR / "events.jsonl"
+TRACE_PATH = TIMING_DIR / "trace.json"
+
+
+class Timeline:
+    """Wall-clock spans of one matrix run, every span is appended to a JSON-lines
+    event log as soon as it ends.
+
+    Times are seconds since the timeline was started. A span of a task carries
+    the task's key, its CPU time where it is known. A resumed timeline keeps the
+    spans of the interrupted run and continues after its last span.
+    """
+
+    def __init__(
+        self, path: pathlib.Path = EVENT_LOG_PATH, resume: bool = False
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.events: list[dict] = read_events(path) if resume and path.is_file() else []
+        last_end = max((event["end"] for event in self.events), default=0.0)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        self.start_time = time.monotonic() - last_end
+
+    def add(
+        self,
+        name: str,
+        phase: str,
+        start: float,
+        end: float,
+        key: tuple | None = None,
+        cpu_s: float | None = None,
+    ) -> None:
+        event = {
+            "name": name,
+            "phase": phase,
+            "start": round(start - self.start_time, 6),
+            "end": round(end - self.start_time, 6),
+        }
+        if key is not None:
+            event["key"] = list(key)
+        if cpu_s is not None:
+            event["cpu_s"] = round(cpu_s, 3)
+        self.events.append(event)
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Timeline of the running matrix, spans are not recorded without one
+_timeline: Timeline | None = None
+
+
+def start(path: pathlib.Path = EVENT_LOG_PATH, resume: bool = False) -> Timeline:
+    global _timeline
+    _timeline = Timeline(path, resume)
+    return _timeline
+
+
+def add(
+    name: str,
+    phase: str,
+    start: float,
+    end: float,
+    key: tuple | None = None,
+    cpu_s: float | None = None,
+) -> None:
+    """Records a span measured elsewhere, `start` and `end` are time.monotonic()
+    values of this process."""
+    if _timeline is not None:
+        _timeline.add(name, phase, start, end, key, cpu_s)
+
+
+@contextlib.contextmanager
+def span(name: str, phase: str, key: tuple | None = None) -> Iterator[dict]:
+    """Records the enclosed block. CPU seconds of work done outside this process
+    can be set as "cpu_s" in the yielded dict."""
+    extra = {}
+    start_time = time.monotonic()
+    try:
+        yield extra
+    finally:
+        add(name, phase, start_time, time.monotonic(), key, extra.get("cpu_s"))
+
+
+def call_with_cpu_time(func: Callable):
+    """Calls `func` and returns its result and the CPU seconds it took, for
+    functions that run in an executor process."""
+    cpu_start = time.process_time()
+    result = func()
+    return result, time.process_time() - cpu_start
+
+
+def cpu_time() -> float:
+    """CPU seconds of this process and all of its terminated children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def task_durations(events: list[dict]) -> dict[tuple, float]:
+    """Time every task spent working, without waiting for resources."""
+    durations: dict[tuple, float] = {}
+    for event in events:
+        if "key" in event:
+            key = tuple(event["key"])
+            durations[key] = durations.get(key, 0.0) + event["end"] - event["start"]
+    return durations
+
+
+def print_summary(
+    events: list[dict],
+    critical_path: tuple[float, list[tuple]] | None = None,
+    total_cpu_s: float | None = None,
+) -> None:
+    fname = "Timeline"
+    if not events:
+        info(fname, "No spans recorded")
+        return
+    wall_s = max(event["end"] for event in events) - min(
+        event["start"] for event in events
+    )
+    # Phase: [spans, busy seconds, known CPU seconds]
+    phases: dict[str, list] = {}
+    for event in events:
+        phase = phases.setdefault(event["phase"], [0, 0.0, 0.0])
+        phase[0] += 1
+        phase[1] += event["end"] - event["start"]
+        phase[2] += event.get("cpu_s", 0.0)
+    busy_s = sum(phase[1] for phase in phases.values())
+
+    info(fname, f"Wall time {wall_s:.1f}s, busy time of all spans {busy_s:.1f}s")
+    if total_cpu_s is not None:
+        info(fname, f"Total CPU time {total_cpu_s:.1f}s")
+    if critical_path is not None:
+        path_s, path_keys = critical_path
+        info(fname, f"Critical path {path_s:.1f}s over {len(path_keys)} tasks:")
+        for key in path_keys:
+            info(fname, f"\t{'/'.join(str(part) for part in key)}")
+    for name, (count, phase_busy_s, phase_cpu_s) in sorted(
+        phases.items(), key=lambda item: -item[1][1]
+    ):
+        cpu_str = f", {phase_cpu_s:.1f}s CPU" if phase_cpu_s else ""
+        info(
+            fname,
+            f"\t{name:14} {count:5} spans {phase_busy_s:9.1f}s "
+            f"{100 * phase_busy_s / busy_s if busy_s else 0.0:5.1f}%{cpu_str}",
+        )
+
+
+def write_chrome_trace(events: list[dict], path: pathlib.Path = TRACE_PATH) -> None:
+    """Writes the spans in the Chrome trace event format (chrome://tracing,
+    Perfetto). Overlapping spans are put on separate lanes."""
+    lane_ends: list[float] = []
+    trace_events = []
+    for event in sorted(events, key=lambda event: event["start"]):
+        lane = next(
+            (i for i, end in enumerate(lane_ends) if end <= event["start"]),
+            len(lane_ends),
+        )
+        if lane == len(lane_ends):
+            lane_ends.append(0.0)
+        lane_ends[lane] = event["end"]
+        args = {name: event[name] for name in ("key", "cpu_s") if name in event}
+        trace_events.append(
+            {
+                "name": event["name"],
+                "cat": event["phase"],
+                "ph": "X",
+                "ts": round(event["start"] * 1e6),
+                "dur": round((event["end"] - event["start"]) * 1e6),
+                "pid": 1,
+                "tid": lane,
+                "args": args,
+            }
+        )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as trace_file:
+        json.dump({"traceEvents": trace_events}, trace_file)
+
+
+def read_events(path: pathlib.Path) -> list[dict]:
+    events = []
+    with open(path, "r", encoding="utf-8") as events_file:
+        for line in events_file:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Empty line or last line of an interrupted write
+                continue
+    return events
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="Timeline",
+        description="Summarizes the event log of a run-test-matrix.py run",
+    )
+    parser.add_argument("events", type=pathlib.Path, nargs="?", default=EVENT_LOG_PATH)
+    parser.add_argument(
+        "--chrome", type=pathlib.Path, help="Also write a Chrome trace to this path"
+    )
+    args = parser.parse_args()
+
+    events = read_events(args.events)
+    print_summary(events)
+    if args.chrome:
+        write_chrome_trace(events, args.chrome)
+
+
+if __name__ == "__main__":
+    main()
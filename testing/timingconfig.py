@@ -199,6 +199,8 @@ INT_ARITH_VI = [
     "vslidedown_vi",
 ]
 
+INT_MOVE_SCALAR = ["vmv_s_x"]
+
 V_SHORT_SIGNAL = (
     INT_ARITH_VV
     + INT_ARITH_VX
@@ -207,9 +209,75 @@ V_SHORT_SIGNAL = (
     + INT_ARITH_VMERGE
     + INT_EXT
     + RED_VV
-    + ["vmv_s_x"]
+    + INT_MOVE_SCALAR
 )
 
+# vset(i)vl(i) retires after ID
+VSET = ["vsetvl", "vsetvli", "vsetivli"]
+
+# Instruction classes for the per-class error breakdown. The classes are
+# disjoint: an instruction belongs to the first class that lists it. Everything
+# else (scalar and unclassified vector instructions) falls into OTHER_CLASS.
+INSTR_CLASSES = {
+    "INT_ARITH_VV": INT_ARITH_VV,
+    "INT_ARITH_VX": INT_ARITH_VX,
+    "INT_ARITH_VI": INT_ARITH_VI,
+    "INT_ARITH_VMV": INT_ARITH_VMV,
+    "INT_ARITH_VMERGE": INT_ARITH_VMERGE,
+    "INT_EXT": INT_EXT,
+    "INT_MOVE_SCALAR": INT_MOVE_SCALAR,
+    "RED_VV": RED_VV,
+    "ELEM_VV": ELEM_VV,
+    "LSU": LSU,
+    "VWXUNARY0": VWXUNARY0,
+    "VSET": VSET,
+}
+OTHER_CLASS = "OTHER"
+OTHER_CLASS_ID = 0
+INSTR_CLASS_NAMES = [OTHER_CLASS] + list(INSTR_CLASSES.keys())
+
+
+def build_class_ids() -> dict[str, int]:
+    """Returns a lookup table from instruction name to class ID (index into INSTR_CLASS_NAMES)."""
+    class_ids: dict[str, int] = {}
+    for class_id, class_name in enumerate(INSTR_CLASS_NAMES):
+        for instr in INSTR_CLASSES.get(class_name, []):
+            class_ids.setdefault(instr, class_id)
+    return class_ids
+
+
+INSTR_CLASS_IDS = build_class_ids()
+
+# ETISS timing columns (fast comparator naming) at which an instruction
+# retires, used when the class-aware timing stage selection is enabled. Only
+# the slow vector classes (V_LONG_SIGNAL: LSU, VWXUNARY0) retire later than
+# EX, vset and short vector instructions signal the scalar core from EX.
+SCALAR_TIMING_STAGE = "EX_stg"
+VSET_TIMING_STAGE = "EX_stg"
+FAST_TIMING_STAGE = "EX_stg"
+SLOW_TIMING_STAGE = "V_EX_LSU_ELM_Pack_substg"
+
+
+def build_class_timing_stages() -> list[str]:
+    """Returns the timing stage name for every class ID."""
+    timing_stages = []
+    for class_name in INSTR_CLASS_NAMES:
+        instrs = INSTR_CLASSES.get(class_name, [])
+        if not instrs:
+            timing_stages.append(SCALAR_TIMING_STAGE)
+        elif all(instr in V_SHORT_SIGNAL for instr in instrs):
+            timing_stages.append(FAST_TIMING_STAGE)
+        elif all(instr in VSET for instr in instrs):
+            timing_stages.append(VSET_TIMING_STAGE)
+        elif all(instr in V_LONG_SIGNAL for instr in instrs):
+            timing_stages.append(SLOW_TIMING_STAGE)
+        else:
+            timing_stages.append(SCALAR_TIMING_STAGE)
+    return timing_stages
+
+
+INSTR_CLASS_TIMING_STAGES = build_class_timing_stages()
+
 # V_RESULT_SIGNAL = V_MOVE_TO_SCALAR
 
 # INT_REDUCE = [
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+
+import config
+from simcache import model_hash, program_hash
+from util import info
+
+SRC_DIR = pathlib.Path(__file__).parent.resolve()
+COMPARISON_PRJ_DIR = SRC_DIR.parent
+
+ARCHIVE_DIR = (
+    pathlib.Path(config.GOLDEN_ARCHIVE_DIR)
+    if config.GOLDEN_ARCHIVE_DIR
+    else COMPARISON_PRJ_DIR / "comparison" / "cache" / "golden"
+)
+# entries/<key>.json points to blobs/<content hash>.gz, identical traces of
+# different keys share one blob. The mtime of an entry is its last use.
+ENTRIES_DIR = ARCHIVE_DIR / "entries"
+BLOBS_DIR = ARCHIVE_DIR / "blobs"
+
+COPY_CHUNK_SIZE = 1 << 20
+
+# Serializes the eviction of threads adding traces
+_lock = threading.Lock()
+
+
+def golden_key(params: dict) -> tuple[str, dict] | None:
+    """Key of a Verilator trace: RTL model hash, program hash, VLEN, VLANE_WIDTH.
+
+    None if the model or program files do not exist.
+    """
+    model = model_hash("verilator", params)
+    program = program_hash("verilator", params)
+    if model is None or program is None:
+        return None
+    inputs = {
+        "model": model,
+        "program": program,
+        "vlen": params["vlen"],
+        "vlane_width": params["vlane_width"],
+    }
+    key_string = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest(), inputs
+
+
+def lookup(key: str) -> tuple[pathlib.Path, dict] | None:
+    """Returns the compressed golden trace of `key` and its entry, marking it used."""
+    entry_path = ENTRIES_DIR / f"{key}.json"
+    try:
+        with open(entry_path, "r", encoding="utf-8") as entry_file:
+            entry = json.load(entry_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    blob_path = BLOBS_DIR / f"{entry['blob']}.gz"
+    if not blob_path.is_file():
+        return None
+    os.utime(entry_path)
+    return blob_path, entry
+
+
+def linked_trace(trace_dir: pathlib.Path, target: str) -> pathlib.Path:
+    """Path of the golden trace a run links into its Verilator trace directory."""
+    return trace_dir / f"{target}_trace.txt.gz"
+
+
+def link(blob_path: pathlib.Path, path: pathlib.Path) -> bool:
+    """Links an archived trace to `path`, copies it if the archive is on another
+    file system. The link stays readable when another process evicts the entry
+    before the comparison read it. False if the trace was evicted already."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    try:
+        os.link(blob_path, path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            shutil.copyfile(blob_path, path)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def add(key: str, inputs: dict, trace_path: pathlib.Path, outcome: dict) -> None:
+    """Compresses a Verilator trace into the archive, then applies the size bound."""
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    ENTRIES_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Blobs are shared, concurrent writers of the same trace must not collide
+    tmp_blob_path = BLOBS_DIR / f".{key}.tmp"
+    content_hash = hashlib.sha256()
+    with open(trace_path, "rb") as trace, gzip.open(
+        tmp_blob_path, "wb", compresslevel=config.GOLDEN_ARCHIVE_COMPRESSLEVEL
+    ) as blob:
+        while chunk := trace.read(COPY_CHUNK_SIZE):
+            content_hash.update(chunk)
+            blob.write(chunk)
+
+    blob = content_hash.hexdigest()
+    blob_path = BLOBS_DIR / f"{blob}.gz"
+    if blob_path.is_file():
+        tmp_blob_path.unlink()
+    else:
+        tmp_blob_path.rename(blob_path)
+
+    tmp_entry_path = ENTRIES_DIR / f".{key}.tmp"
+    with open(tmp_entry_path, "w", encoding="utf-8") as entry_file:
+        json.dump(dict(outcome, blob=blob, inputs=inputs), entry_file, indent=2)
+    with _lock:
+        tmp_entry_path.rename(ENTRIES_DIR / f"{key}.json")
+        evict(config.GOLDEN_ARCHIVE_MAX_MB << 20)
+
+
+def evict(max_bytes: int) -> None:
+    """Removes least recently used entries until the blobs fit into `max_bytes`.
+
+    Traces linked for a comparison stay on disk until the comparison deleted
+    them, the archive may exceed the bound by them.
+    """
+    fname = "evict"
+    entries = []
+    for entry_path in ENTRIES_DIR.glob("*.json"):
+        with open(entry_path, "r", encoding="utf-8") as entry_file:
+            entries.append(
+                (entry_path.stat().st_mtime, entry_path, json.load(entry_file)["blob"])
+            )
+    entries.sort()
+
+    blob_sizes = {
+        blob_path.name.removesuffix(".gz"): blob_path.stat().st_size
+        for blob_path in BLOBS_DIR.glob("*.gz")
+    }
+    users: dict[str, int] = {}
+    for _, _, blob in entries:
+        users[blob] = users.get(blob, 0) + 1
+
+    total_bytes = sum(blob_sizes.values())
+    for _, entry_path, blob in entries:
+        if total_bytes <= max_bytes:
+            break
+        entry_path.unlink()
+        users[blob] -= 1
+        if users[blob] == 0 and blob in blob_sizes:
+            (BLOBS_DIR / f"{blob}.gz").unlink()
+            total_bytes -= blob_sizes[blob]
+            info(
+                fname, f"Evicted golden trace {blob[:12]} ({blob_sizes[blob] >> 20} MB)"
+            )